@@ -0,0 +1,228 @@
+import argparse
+from datetime import datetime
+import json
+import logging
+from multiprocessing import Pool
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import unbabel_cli
+from generate_events import generate_events, write_events
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s',
+                    handlers=[logging.StreamHandler()])
+
+# Engines measured stage by stage, and engines measured end to end with their command line arguments
+STAGED_ENGINES = ('legacy', 'python', 'python-fast', 'numpy')
+END_TO_END_ENGINES = {
+    'streaming-python': [],
+    'streaming-python-fast': ['--decoder', 'fast'],
+    'streaming-numpy': ['--engine', 'numpy'],
+    'streaming-workers': ['--workers', str(os.cpu_count() or 1), '--dedup_horizon', '60'],
+}
+
+def _measure(stages, event_count):
+    # Run the stages in order, each taking the result of the previous one
+    results = {}
+    value = None
+    for name, stage in stages:
+        started = time.perf_counter()
+        value = stage(value)
+        seconds = time.perf_counter() - started
+        results[name] = {
+            'seconds': round(seconds, 4),
+            'events_per_second': round(event_count / seconds) if seconds else None,
+            'peak_rss_mb': unbabel_cli.peak_rss_mb(),
+        }
+    return results
+
+def _run_engine(engine, input_file, window_size, output_dir, event_count):
+    '''
+    Worker process: measure one engine on the input file, so that every engine starts with a fresh peak RSS.
+    '''
+    # Only the measurements are of interest
+    logging.getLogger().setLevel(logging.WARNING)
+    output_file = f'{engine}.txt'
+
+    if engine in END_TO_END_ENGINES:
+        argv = ['--input_file', input_file, '--window_size', str(window_size), '--output_dir', output_dir,
+                '--output_file', output_file] + END_TO_END_ENGINES[engine]
+        return _measure([('end_to_end', lambda _: unbabel_cli.main(argv))], event_count)
+
+    if engine == 'legacy':
+        stages = [
+            ('parse', lambda _: unbabel_cli.parse_input(input_file)),
+            ('calculate', lambda translations: unbabel_cli.calculate_moving_average(translations, window_size)),
+            ('output', lambda moving_averages: unbabel_cli.output_moving_averages(((avg,) for avg in moving_averages), [output_file], output_dir=output_dir)),
+        ]
+        return _measure(stages, event_count)
+
+    decoder = unbabel_cli.TranslationDecoder('fast' if engine == 'python-fast' else 'json')
+    average_runs = unbabel_cli.ENGINES['numpy' if engine == 'numpy' else 'python']
+    calculate = lambda events: list(average_runs(events, [window_size]))
+
+    stages = [
+        ('parse', lambda _: list(unbabel_cli.read_events(input_file, decoder=decoder))),
+        ('calculate', calculate),
+        ('output', lambda runs: unbabel_cli.output_blocks(unbabel_cli.format_average_runs(runs, [window_size]), [output_file], output_dir=output_dir)),
+    ]
+    return _measure(stages, event_count)
+
+def run_benchmark(input_file, window_size=10, engines=None):
+    '''
+    Measure the wall time, throughput and peak RSS of each stage of each engine on an input file.
+
+    Each engine runs in its own process. Staged engines materialize the result of every stage (parsing,
+    calculation and output), so each stage can be timed on its own, and the peak RSS of a stage is the
+    peak of its process by the end of the stage. End to end engines run the whole command line program.
+
+    Parameters:
+        input_file -> str: The path to the input file.
+        window_size -> int: The window size of the moving averages (optional).
+        engines -> list: The engines to measure, among STAGED_ENGINES and END_TO_END_ENGINES (optional). Defaults to all
+                         those available.
+
+    Returns:
+        report -> dict: The environment of the benchmark and the measurements of each engine.
+    '''
+    if engines is None:
+        engines = [engine for engine in STAGED_ENGINES + tuple(END_TO_END_ENGINES)
+                   if unbabel_cli.np is not None or 'numpy' not in engine]
+
+    with open(input_file, 'rb') as file:
+        event_count = sum(1 for _ in file)
+
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'input_file': input_file,
+        'input_bytes': os.path.getsize(input_file),
+        'events': event_count,
+        'window_size': window_size,
+        'results': {},
+    }
+
+    output_dir = tempfile.mkdtemp()
+    try:
+        for engine in engines:
+            logging.info(f"Measuring the {engine} engine")
+            with Pool(1) as pool:
+                report['results'][engine] = pool.apply(_run_engine, (engine, input_file, window_size, output_dir, event_count))
+    finally:
+        shutil.rmtree(output_dir)
+
+    return report
+
+def compare_reports(report, baseline, tolerance=0.1):
+    '''
+    Compare the wall times of a report with those of a previous one, logging the stages that got slower.
+
+    Parameters:
+        report -> dict: The report, as produced by run_benchmark().
+        baseline -> dict: The previous report.
+        tolerance -> float: The relative slowdown tolerated before a stage is reported (optional).
+
+    Returns:
+        bool: True if no stage is slower than the baseline by more than tolerance, False otherwise.
+    '''
+    if report['events'] != baseline['events']:
+        logging.warning(f"The baseline was measured on {baseline['events']} events instead of {report['events']}")
+
+    passed = True
+    for engine, stages in report['results'].items():
+        for stage, result in stages.items():
+            previous = baseline['results'].get(engine, {}).get(stage)
+            if not previous or not previous['seconds']:
+                continue
+
+            ratio = result['seconds'] / previous['seconds']
+            message = f"{engine} {stage}: {result['seconds']}s against {previous['seconds']}s ({ratio - 1:+.1%})"
+            if ratio > 1 + tolerance:
+                logging.warning(f"Regression in {message}")
+                passed = False
+            else:
+                logging.info(message)
+    return passed
+
+def parse_cli_arguments(argv=None):
+    '''
+    Parses command line arguments for the benchmark.
+
+    Parameters:
+        argv -> list: The arguments to parse (optional). Defaults to the ones the program was called with.
+
+    Returns:
+        args -> The parsed command line arguments
+    '''
+    parser = argparse.ArgumentParser(description="Measure the throughput and memory of each stage of each engine.")
+    parser.add_argument("--input_file", help="Path to the input file (optional). Defaults to generating one with the options below.")
+    parser.add_argument("--rate", type=float, default=1000, help="Average number of events per minute of the generated input (optional).")
+    parser.add_argument("--span", type=int, default=600, help="Number of minutes covered by the generated input (optional).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated input (optional).")
+    parser.add_argument("--window_size", type=int, default=10, help="The window size of the moving averages (optional).")
+    parser.add_argument("--engines", nargs='+', choices=STAGED_ENGINES + tuple(END_TO_END_ENGINES), help="The engines to measure (optional). Defaults to all those available.")
+    parser.add_argument("--report_file", help="Path to the JSON file the report is written to (optional). Defaults to the standard output.")
+    parser.add_argument("--compare", help="Path to a previous report to compare the wall times against (optional).")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slowdown tolerated when comparing against a previous report (optional).")
+
+    args = parser.parse_args(argv)
+
+    if args.window_size <= 0:
+        logging.error("Error: Window size must be a positive integer")
+        return
+    if args.engines and unbabel_cli.np is None and any('numpy' in engine for engine in args.engines):
+        logging.error("Error: The numpy engines require NumPy to be installed")
+        return
+
+    return args
+
+def main(argv=None):
+    '''
+    Returns:
+        bool: False if a regression was found against the compared report, True otherwise.
+    '''
+    args = parse_cli_arguments(argv)
+    if not args:
+        return False
+
+    temp_dir = None
+    input_file = args.input_file
+    try:
+        if input_file is None:
+            temp_dir = tempfile.mkdtemp()
+            input_file = os.path.join(temp_dir, 'events.json')
+            count = write_events(input_file, generate_events(rate=args.rate, span=args.span, seed=args.seed, duplicate_ratio=0.01, boundary_ratio=0.01))
+            logging.info(f"Generated {count} events")
+
+        report = run_benchmark(input_file, args.window_size, args.engines)
+
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    if args.input_file is None:
+        report['input_file'] = None
+        report['generator'] = {'rate': args.rate, 'span': args.span, 'seed': args.seed}
+
+    serialized = json.dumps(report, indent=2)
+    if args.report_file:
+        with open(args.report_file, 'w') as file:
+            file.write(f'{serialized}\n')
+        logging.info(f"Report has been saved in {args.report_file}")
+    else:
+        print(serialized)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            return compare_reports(report, json.load(file), args.tolerance)
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
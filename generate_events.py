@@ -0,0 +1,129 @@
+import argparse
+from collections import deque
+from datetime import datetime, timedelta
+import json
+import logging
+import random
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s',
+                    handlers=[logging.StreamHandler()])
+
+LANGUAGES = ('en', 'fr', 'de', 'es', 'pt', 'it', 'ja', 'zh')
+
+def generate_events(rate=100, span=1440, start=datetime(2018, 12, 26, 18), gap_ratio=0.0, gap_length=60,
+                    duplicate_ratio=0.0, clients=10, boundary_ratio=0.0, seed=0):
+    '''
+    Lazily generate translation events sorted by timestamp, always the same for the same parameters.
+
+    Parameters:
+        rate -> float: Average number of events per active minute (optional).
+        span -> int: Number of minutes covered by the events, including gaps (optional).
+        start -> datetime: The first minute (optional).
+        gap_ratio -> float: Probability that an idle gap starts at each minute (optional).
+        gap_length -> int: Maximum length of an idle gap in minutes (optional).
+        duplicate_ratio -> float: Probability that an event redelivers a recent translation (optional).
+        clients -> int: Number of distinct client names (optional).
+        boundary_ratio -> float: Probability that an event falls exactly on a minute boundary (optional).
+        seed -> int: Seed of the random number generator (optional).
+
+    Yields:
+        translation -> dict: A translation event, in the input format.
+    '''
+    rng = random.Random(seed)
+    client_names = [f'client-{i}' for i in range(clients)]
+    # Ids of the last translations, which duplicates redeliver
+    recent = deque(maxlen=1000)
+    next_id = 0
+
+    minute = 0
+    while minute < span:
+        if gap_ratio and rng.random() < gap_ratio:
+            minute += rng.randint(1, gap_length)
+            continue
+
+        # Spread the events of the minute uniformly, with some of them exactly on its start
+        count = rng.randint(0, int(2 * rate))
+        offsets = sorted(0 if rng.random() < boundary_ratio else rng.randrange(1, 60_000_000) for _ in range(count))
+
+        for offset in offsets:
+            if recent and rng.random() < duplicate_ratio:
+                translation_id = rng.choice(recent)
+            else:
+                translation_id = f'{next_id:020x}'
+                next_id += 1
+                recent.append(translation_id)
+
+            source_language, target_language = rng.sample(LANGUAGES, 2)
+            yield {
+                "timestamp": (start + timedelta(minutes=minute, microseconds=offset)).strftime("%Y-%m-%d %H:%M:%S.%f"),
+                "translation_id": translation_id,
+                "source_language": source_language,
+                "target_language": target_language,
+                "client_name": rng.choice(client_names),
+                "event_name": "translation_delivered",
+                "nr_words": rng.randint(1, 500),
+                "duration": int(rng.lognormvariate(3.5, 0.8)),
+            }
+
+        minute += 1
+
+def write_events(file_path, events):
+    '''
+    Write events to a file, one JSON line each, in the layout of the input files.
+
+    Returns:
+        int: The number of events written.
+    '''
+    count = 0
+    with open(file_path, 'w') as file:
+        for event in events:
+            file.write(f'{json.dumps(event)}\n')
+            count += 1
+    return count
+
+def parse_cli_arguments(argv=None):
+    '''
+    Parses command line arguments for the generator.
+
+    Parameters:
+        argv -> list: The arguments to parse (optional). Defaults to the ones the program was called with.
+
+    Returns:
+        args -> The parsed command line arguments
+    '''
+    parser = argparse.ArgumentParser(description="Generate a sorted file of synthetic translation events.")
+    parser.add_argument("--output_file", required=True, help="Path to the file to write the events to.")
+    parser.add_argument("--rate", type=float, default=100, help="Average number of events per active minute (optional).")
+    parser.add_argument("--span", type=int, default=1440, help="Number of minutes covered by the events, including gaps (optional).")
+    parser.add_argument("--start", type=lambda value: datetime.strptime(value, "%Y-%m-%d %H:%M"), default=datetime(2018, 12, 26, 18), help="The first minute, as YYYY-MM-DD HH:MM (optional).")
+    parser.add_argument("--gap_ratio", type=float, default=0.0, help="Probability that an idle gap starts at each minute (optional).")
+    parser.add_argument("--gap_length", type=int, default=60, help="Maximum length of an idle gap in minutes (optional).")
+    parser.add_argument("--duplicate_ratio", type=float, default=0.0, help="Probability that an event redelivers a recent translation (optional).")
+    parser.add_argument("--clients", type=int, default=10, help="Number of distinct client names (optional).")
+    parser.add_argument("--boundary_ratio", type=float, default=0.0, help="Probability that an event falls exactly on a minute boundary (optional).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator, the same seed always giving the same file (optional).")
+
+    args = parser.parse_args(argv)
+
+    if args.rate < 0 or args.span <= 0 or args.gap_length <= 0 or args.clients <= 0:
+        logging.error("Error: The rate must not be negative, and the span, gap length and number of clients must be positive")
+        return
+    if not all(0 <= ratio <= 1 for ratio in (args.gap_ratio, args.duplicate_ratio, args.boundary_ratio)):
+        logging.error("Error: Ratios must be between 0 and 1")
+        return
+
+    return args
+
+def main(argv=None):
+    args = parse_cli_arguments(argv)
+    if not args:
+        return
+
+    events = generate_events(args.rate, args.span, args.start, args.gap_ratio, args.gap_length,
+                             args.duplicate_ratio, args.clients, args.boundary_ratio, args.seed)
+    count = write_events(args.output_file, events)
+    logging.info(f"{count} events have been generated and saved in {args.output_file}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
 import unittest
+import csv
+import io
 import json
 from datetime import datetime
-from unbabel_cli import parse_input, calculate_moving_average, output_moving_average
+from unbabel_cli import parse_input, calculate_moving_average, output_moving_average, read_events, stream_moving_average, stream_window_averages, InputError, DuplicateFilter, parse_timestamp, np, aggregate_minutes, split_file, read_buckets_parallel, main, aggregate_group_minutes, grouped_window_averages, format_minute, follow_lines, QuantileSketch, TranslationDecoder, window_average_runs, numpy_window_averages, minute_runs, format_average_runs, BINARY_OUTPUT_MAGIC, RateLimitedLog, ReorderBuffer
 from collections import deque
 import os
 import filecmp
+import asyncio
+import random
+import socket
+import tempfile
+import gzip
+import lzma
+import struct
+import subprocess
+import sys
+import threading
+import time
+from unittest import mock
+from generate_events import generate_events, write_events
+from unbabel_server import MinuteRing, AggregationServer, send_events, query
 
 EXAMPLE_INPUT = 'inputs/example_input.json'
 EXAMPLE_OUTPUT = 'outputs/example_output.json'
@@ -21,6 +37,15 @@ class TestTranslationApp(unittest.TestCase):
         '''
         with open(TEMP_INPUT, 'w') as file:
             file.write(data)
+
+    def format_runs(self, runs, window_sizes):
+        '''
+        Auxilary function that renders runs of moving averages as format_average_runs() does for the
+        output files, returning the records of each window
+        '''
+        blocks = list(format_average_runs(runs, window_sizes))
+        return [[json.loads(line) for line in ''.join(block[i] for block in blocks).splitlines()]
+                for i in range(len(window_sizes))]
    
     def test_parse_example_file(self):
         '''
@@ -259,11 +284,655 @@ class TestTranslationApp(unittest.TestCase):
             # Clean up the temporary file
             os.remove(output_file_path)
     
+    def test_stream_moving_average_is_lazy(self):
+        '''
+        This validates that stream_moving_average() yields a minute as soon as a later
+        event is read, without consuming the rest of the input.
+        '''
+        def events():
+            yield parse_timestamp("2018-12-26 18:11:08.509654"), 20
+            yield parse_timestamp("2018-12-26 18:13:19.903159"), 31
+            raise AssertionError("The input should not be read past the second event")
+
+        moving_averages = stream_moving_average(events(), 10)
+        self.assertEqual(next(moving_averages), {"date": "2018-12-26 18:11:00", "average_delivery_time": "0"})
+        self.assertEqual(next(moving_averages), {"date": "2018-12-26 18:12:00", "average_delivery_time": "20"})
+        self.assertEqual(next(moving_averages), {"date": "2018-12-26 18:13:00", "average_delivery_time": "20"})
+
+    def test_streaming_pipeline_example(self):
+        '''
+        This validates that the lazy pipeline produces the same output as the example
+        '''
+        try:
+            moving_averages = stream_moving_average(read_events(EXAMPLE_INPUT), 10)
+            self.assertTrue(output_moving_average(moving_averages, TEMP_OUTPUT))
+            output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+            self.assertTrue(filecmp.cmp(output_file_path, EXAMPLE_OUTPUT))
+
+        finally:
+            os.remove(output_file_path)
+
+    def test_streaming_pipeline_invalid_input(self):
+        '''
+        This validates that no partial output is left behind when an invalid
+        translation is found halfway through the input
+        '''
+        try:
+            self.create_temp_input_file('{"timestamp": "2018-12-26 18:11:08.509654","translation_id": "5aa5b2f39f7254a75aa5","source_language": "en","target_language": "fr","client_name": "airliberty","event_name": "translation_delivered","nr_words": 30, "duration": 20}\n\
+                                    {"timestamp": "2018-12-26 18:15:19.903159","translation_id": "5aa5b2f39f7254a75aa4","source_language": "en","target_language": "fr","client_name": "airliberty","event_name": "translation_delivered","nr_words": "30", "duration": 31}\n')
+
+            moving_averages = stream_moving_average(read_events(TEMP_INPUT), 10)
+            with self.assertRaises(InputError):
+                output_moving_average(moving_averages, TEMP_OUTPUT)
+            self.assertFalse(os.path.exists(os.path.join('outputs/', TEMP_OUTPUT)))
+            self.assertFalse(os.path.exists(os.path.join('outputs/', TEMP_OUTPUT + '.tmp')))
+
+        finally:
+            os.remove(TEMP_INPUT)
+
+    def test_parse_timestamp(self):
+        '''
+        This validates that parse_timestamp() agrees with strptime and rejects the
+        timestamps strptime rejects
+        '''
+        for timestamp in ["2018-12-26 18:11:08.509654", "2020-02-29 23:59:59.999999", "2018-12-26 18:11:08.5", "1970-01-01 00:00:00.000000"]:
+            expected = (datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f") - datetime(1970, 1, 1)).total_seconds()
+            self.assertAlmostEqual(parse_timestamp(timestamp) / 1_000_000, expected, places=6)
+
+        for timestamp in ["invalid_timestamp", "2019-02-29 18:11:08.509654", "2018-12-26 24:11:08.509654", "2018-12-26 18:60:08.509654", "2018-12-26 18:11:08.50965x", "2018-12-26T18:11:08.509654"]:
+            with self.assertRaises(ValueError):
+                parse_timestamp(timestamp)
+
+    @unittest.skipUnless(np, "NumPy is not installed")
+    def test_numpy_engine_example(self):
+        '''
+        This validates that the NumPy engine matches the streaming engine on the example input
+        for several window sizes, including the edge cases
+        '''
+        for window_size in [1, 10, 14]:
+            runs = minute_runs(numpy_window_averages(read_events(EXAMPLE_INPUT), [window_size]))
+            self.assertEqual(self.format_runs(runs, [window_size])[0],
+                             list(stream_moving_average(read_events(EXAMPLE_INPUT), window_size)))
+
+    @unittest.skipUnless(np, "NumPy is not installed")
+    def test_numpy_engine_minute_boundaries(self):
+        '''
+        This validates that the NumPy engine keeps the strict window boundaries for
+        events falling exactly on a minute
+        '''
+        events = [(parse_timestamp("2018-12-26 18:11:00.000000"), 10),
+                  (parse_timestamp("2018-12-26 18:11:00.000001"), 20),
+                  (parse_timestamp("2018-12-26 18:13:00.000000"), 40),
+                  (parse_timestamp("2018-12-26 18:15:59.999999"), 50)]
+        for window_size in [1, 2, 3]:
+            runs = minute_runs(numpy_window_averages(events, [window_size]))
+            self.assertEqual(self.format_runs(runs, [window_size])[0], list(stream_moving_average(events, window_size)))
+
+    def test_window_average_runs_example(self):
+        '''
+        This validates that aggregating per minute first gives the same moving averages,
+        including for events falling exactly on a minute
+        '''
+        events = list(read_events(EXAMPLE_INPUT)) + [(parse_timestamp("2018-12-26 18:24:00.000000"), 10),
+                                                     (parse_timestamp("2018-12-26 18:26:00.000000"), 70)]
+        for window_size in [1, 2, 10]:
+            runs = window_average_runs(aggregate_minutes(events), [window_size])
+            self.assertEqual(self.format_runs(runs, [window_size])[0], list(stream_moving_average(events, window_size)))
+
+    def test_split_file(self):
+        '''
+        This validates that split_file() covers the whole file with ranges starting at line starts
+        '''
+        chunks = split_file(EXAMPLE_INPUT, 2)
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], os.path.getsize(EXAMPLE_INPUT))
+        with open(EXAMPLE_INPUT, 'rb') as file:
+            for start, _ in chunks[1:]:
+                file.seek(start - 1)
+                self.assertEqual(file.read(1), b'\n')
+
+        # More parts than lines can only give one range per line
+        self.assertEqual(len(split_file(EXAMPLE_INPUT, 10)), 3)
+
+    def test_parallel_duplicates_across_chunks(self):
+        '''
+        This validates that parallel processing detects duplicates split across chunks
+        '''
+        try:
+            lines = ['{"timestamp": "2018-12-26 18:%02d:08.509654","translation_id": "%s","source_language": "en","target_language": "fr","client_name": "airliberty","event_name": "translation_delivered","nr_words": 30, "duration": %d}\n' % (minute, translation_id, duration)
+                     for minute, translation_id, duration in [(11, "a", 20), (12, "b", 30), (13, "a", 500), (14, "c", 40), (15, "b", 600), (16, "d", 50)]]
+            self.create_temp_input_file(''.join(lines))
+            options = {'horizon': 5, 'mode': 'exact', 'capacity': 1000, 'error_rate': 0.001}
+
+            expected_output = self.format_runs(window_average_runs(aggregate_minutes(read_events(TEMP_INPUT, DuplicateFilter(horizon=5))), [3]), [3])
+            self.assertEqual(self.format_runs(window_average_runs(read_buckets_parallel(TEMP_INPUT, 3, options), [3]), [3]), expected_output)
+            self.assertNotIn("500", [moving_average['average_delivery_time'] for moving_average in expected_output[0]])
+
+        finally:
+            os.remove(TEMP_INPUT)
+
+    def test_parallel_repeated_deliveries(self):
+        '''
+        This validates that several workers skip the same duplicates as a single process, also for a
+        translation delivered three times with its last two deliveries in different chunks
+        '''
+        try:
+            lines = ['{"timestamp": "2018-12-26 18:%02d:08.509654","translation_id": "%s","source_language": "en","target_language": "fr","client_name": "airliberty","event_name": "translation_delivered","nr_words": 30, "duration": %d}\n' % (minute, translation_id, duration)
+                     for minute, translation_id, duration in [(10, "a", 20), (11, "b", 30), (12, "c", 40), (13, "a", 999), (18, "a", 999), (19, "e", 60), (20, "f", 70), (21, "g", 80)]]
+            self.create_temp_input_file(''.join(lines))
+            # The second chunk starts with the delivery at 18:18, so its replay only sees the one at 18:13
+            self.assertEqual(split_file(TEMP_INPUT, 2)[1][0], len(''.join(lines[:4])))
+
+            for mode in DuplicateFilter.MODES:
+                options = {'horizon': 5, 'mode': mode, 'capacity': 1000, 'error_rate': 0.001}
+                expected_output = self.format_runs(window_average_runs(aggregate_minutes(read_events(TEMP_INPUT, DuplicateFilter(**options))), [10]), [10])
+                self.assertEqual(self.format_runs(window_average_runs(read_buckets_parallel(TEMP_INPUT, 2, options), [10]), [10]), expected_output)
+                # The delivery at 18:18 comes 5 minutes after the one at 18:13
+                self.assertNotIn("999", str(expected_output))
+
+        finally:
+            os.remove(TEMP_INPUT)
+
+    def test_parallel_invalid_line_at_chunk_start(self):
+        '''
+        This validates that with invalid lines skipped, a chunk starting with an invalid line still detects
+        the duplicates of translations from earlier chunks
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        try:
+            lines = ['{"timestamp": "2018-12-26 18:%02d:08.509654","translation_id": "%s","source_language": "en","target_language": "fr","client_name": "airliberty","event_name": "translation_delivered","nr_words": 30, "duration": %d}\n' % (minute, translation_id, duration)
+                     for minute, translation_id, duration in [(11, "a", 20), (12, "b", 30), (13, "c", 40), (14, "d", 50), (15, "e", 60), (16, "a", 999), (17, "f", 70), (18, "g", 80)]]
+            self.create_temp_input_file(''.join(lines))
+            chunk_start = split_file(TEMP_INPUT, 2)[1][0]
+            with open(TEMP_INPUT, 'r+b') as file:
+                file.seek(chunk_start)
+                line_length = len(file.readline())
+                file.seek(chunk_start)
+                file.write(b'x' * (line_length - 1))
+
+            outputs = []
+            for workers in ['1', '2']:
+                main(['--input_file', TEMP_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT,
+                      '--dedup_horizon', '10', '--on_invalid', 'skip', '--workers', workers])
+                with open(output_file_path, 'r') as file:
+                    outputs.append(file.read())
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertNotIn('999', outputs[1])
+
+        finally:
+            for path in [TEMP_INPUT, output_file_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_window_averages_several_sizes(self):
+        '''
+        This validates that every window computed in a single pass matches its own
+        moving average calculation
+        '''
+        events = list(read_events(EXAMPLE_INPUT)) + [(parse_timestamp("2018-12-26 18:25:00.000000"), 70)]
+        window_sizes = [1, 5, 10, 14]
+        records = self.format_runs(window_average_runs(aggregate_minutes(events), window_sizes), window_sizes)
+
+        for i, window_size in enumerate(window_sizes):
+            self.assertEqual(records[i], list(stream_moving_average(events, window_size)))
+
+    def test_combined_windows_output(self):
+        '''
+        This validates that several window sizes can be written as one record per minute
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        try:
+            main(['--input_file', EXAMPLE_INPUT, '--window_size', '1', '10', '--combine_windows', '--output_file', TEMP_OUTPUT])
+            with open(output_file_path, 'r') as file:
+                lines = [json.loads(line) for line in file]
+
+            self.assertEqual(len(lines), 14)
+            self.assertEqual(lines[-1], {"date": "2018-12-26 18:24:00", "average_delivery_time_1": "54", "average_delivery_time_10": "42.5"})
+
+        finally:
+            os.remove(output_file_path)
+
+    def test_window_average_runs_gaps(self):
+        '''
+        This validates that runs of minutes cover the same moving averages as one minute at a time,
+        with a number of runs that does not depend on the length of the gaps
+        '''
+        events = list(read_events(EXAMPLE_INPUT)) + [(parse_timestamp("2018-12-27 18:25:00.000000"), 70),
+                                                     (parse_timestamp("2019-12-27 18:25:30.000000"), 80)]
+        window_sizes = [1, 10]
+        runs = list(window_average_runs(aggregate_minutes(events), window_sizes))
+
+        expanded = [(minute, averages) for start, end, averages in runs for minute in range(start, end)]
+        for i, window_size in enumerate(window_sizes):
+            self.assertEqual([(minute, [averages[i]]) for minute, averages in expanded], list(stream_window_averages(events, window_size)))
+        self.assertLess(len(runs), 20)
+
+    def test_runs_output_format(self):
+        '''
+        This validates that the runs output format holds one line per run of minutes with the same average
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        try:
+            main(['--input_file', EXAMPLE_INPUT, '--window_size', '10', '--output_format', 'runs', '--output_file', TEMP_OUTPUT])
+            with open(output_file_path, 'r') as file:
+                lines = [json.loads(line) for line in file]
+
+            self.assertEqual(lines, [
+                {"from": "2018-12-26 18:11:00", "to": "2018-12-26 18:11:00", "average_delivery_time": "0"},
+                {"from": "2018-12-26 18:12:00", "to": "2018-12-26 18:15:00", "average_delivery_time": "20"},
+                {"from": "2018-12-26 18:16:00", "to": "2018-12-26 18:21:00", "average_delivery_time": "25.5"},
+                {"from": "2018-12-26 18:22:00", "to": "2018-12-26 18:23:00", "average_delivery_time": "31"},
+                {"from": "2018-12-26 18:24:00", "to": "2018-12-26 18:24:00", "average_delivery_time": "42.5"},
+            ])
+
+        finally:
+            os.remove(output_file_path)
+
+    def test_csv_and_binary_output_formats(self):
+        '''
+        This validates that the CSV and binary output formats hold the same moving averages as the JSON lines
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        with open(EXAMPLE_OUTPUT, 'r') as file:
+            expected_lines = [json.loads(line) for line in file]
+
+        try:
+            main(['--input_file', EXAMPLE_INPUT, '--window_size', '10', '--output_format', 'csv', '--output_file', TEMP_OUTPUT])
+            with open(output_file_path, 'r') as file:
+                rows = list(csv.DictReader(file))
+            self.assertEqual([dict(row) for row in rows], expected_lines)
+
+            main(['--input_file', EXAMPLE_INPUT, '--window_size', '10', '--output_format', 'binary', '--output_file', TEMP_OUTPUT])
+            with open(output_file_path, 'rb') as file:
+                self.assertEqual(file.read(12), BINARY_OUTPUT_MAGIC + struct.pack('<I', 1))
+                (row_count,) = struct.unpack('<I', file.read(4))
+                times = struct.unpack(f'<{row_count}q', file.read(8 * row_count))
+                averages = struct.unpack(f'<{row_count}d', file.read(8 * row_count))
+                self.assertEqual(file.read(), b'')
+
+            self.assertEqual([format_minute(time // 60) for time in times], [line["date"] for line in expected_lines])
+            self.assertEqual([f'{average:g}' for average in averages], [line["average_delivery_time"] for line in expected_lines])
+
+        finally:
+            os.remove(output_file_path)
+
+    def test_standard_output(self):
+        '''
+        This validates that the output can be written to the standard output, byte for byte as to a file
+        '''
+        result = subprocess.run([sys.executable, 'unbabel_cli.py', '--input_file', EXAMPLE_INPUT, '--window_size', '10', '--output_file', '-'],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        with open(EXAMPLE_OUTPUT, 'rb') as file:
+            self.assertEqual(result.stdout, file.read())
+
+    def test_grouped_window_averages(self):
+        '''
+        This validates that each group gets the moving average of its own translations,
+        and that only groups with translations in their window are output
+        '''
+        events = list(read_events(EXAMPLE_INPUT, group_by=['client_name']))
+        minute_averages = dict(grouped_window_averages(aggregate_group_minutes(events), 10))
+
+        self.assertEqual(len(minute_averages), 13)
+        self.assertEqual(minute_averages[parse_timestamp("2018-12-26 18:12:00.000000") // 60_000_000], [(("airliberty",), 20)])
+        self.assertEqual(minute_averages[parse_timestamp("2018-12-26 18:24:00.000000") // 60_000_000], [(("airliberty",), 31), (("taxi-eats",), 54)])
+
+        # Each group matches the global moving average of its own translations
+        airliberty_events = [(timestamp, duration) for timestamp, duration, group in events if group == ("airliberty",)]
+        airliberty_averages = {record["date"]: record["average_delivery_time"] for record in stream_moving_average(airliberty_events, 10)}
+        for minute, averages in minute_averages.items():
+            for group, average in averages:
+                if group == ("airliberty",) and format_minute(minute) in airliberty_averages:
+                    self.assertEqual(airliberty_averages[format_minute(minute)], f'{average:g}')
+
+    def test_grouped_window_averages_expiry(self):
+        '''
+        This validates that groups leave the output once their window is empty,
+        including events exactly on a minute boundary
+        '''
+        events = [(parse_timestamp("2018-12-26 18:11:00.000000"), 10, ("a",)),
+                  (parse_timestamp("2018-12-26 18:11:30.000000"), 20, ("b",)),
+                  (parse_timestamp("2018-12-26 18:20:00.000000"), 30, ("a",))]
+        minute_averages = list(grouped_window_averages(aggregate_group_minutes(events), 2))
+
+        # a's boundary events are only in the window for one minute, b's event for two
+        self.assertEqual([(format_minute(minute), averages) for minute, averages in minute_averages],
+                         [("2018-12-26 18:12:00", [(("a",), 10), (("b",), 20)]),
+                          ("2018-12-26 18:13:00", [(("b",), 20)]),
+                          ("2018-12-26 18:21:00", [(("a",), 30)])])
+
+    def test_follow_lines_appends_and_rotation(self):
+        '''
+        This validates that follow_lines() yields lines as they are appended, waits for
+        incomplete lines and follows the file when it is replaced
+        '''
+        rotated_input = TEMP_INPUT + '.1'
+
+        def write_lines():
+            with open(TEMP_INPUT, 'a') as file:
+                file.write('second')
+            time.sleep(0.1)
+            with open(TEMP_INPUT, 'a') as file:
+                file.write(' line\n')
+            time.sleep(0.1)
+            os.replace(TEMP_INPUT, rotated_input)
+            self.create_temp_input_file('third line\n')
+
+        try:
+            self.create_temp_input_file('first line\n')
+            writer = threading.Thread(target=write_lines)
+            writer.start()
+            lines = list(follow_lines(TEMP_INPUT, poll_interval=0.01, idle_timeout=0.5))
+            writer.join()
+
+            self.assertEqual(lines, [b'first line\n', b'second line\n', b'third line\n'])
+
+        finally:
+            os.remove(TEMP_INPUT)
+            os.remove(rotated_input)
+
+    def test_follow_mode_output(self):
+        '''
+        This validates that follow mode produces the same output as a regular run once the input stops growing
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        try:
+            main(['--input_file', EXAMPLE_INPUT, '--window_size', '10', '--follow', '--poll_interval', '0.01', '--idle_timeout', '0.1', '--output_file', TEMP_OUTPUT])
+            self.assertTrue(filecmp.cmp(output_file_path, EXAMPLE_OUTPUT))
+
+        finally:
+            os.remove(output_file_path)
+
+    def test_checkpoint_resume(self):
+        '''
+        This validates that a run interrupted by an invalid translation can be resumed from its
+        checkpoint once the input is fixed, with the same output as an uninterrupted run
+        '''
+        checkpoint_file = TEMP_INPUT + '.checkpoint'
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        with open(EXAMPLE_INPUT, 'r') as file:
+            lines = [line.rstrip('\n') + '\n' for line in file]
+        duplicate = lines[0].replace('18:11:08.509654', '18:23:19.903159').replace('"duration": 20', '"duration": 999')
+
+        try:
+            self.create_temp_input_file(lines[0] + lines[1] + '{"timestamp": "2018-12-26 18:23:19.903159"}\n')
+            main(['--input_file', TEMP_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT,
+                  '--checkpoint_file', checkpoint_file, '--checkpoint_interval', '0'])
+            self.assertTrue(os.path.exists(checkpoint_file))
+            self.assertFalse(os.path.exists(output_file_path))
+
+            # The duplicate after the checkpoint is only detected if the seen ids were restored
+            self.create_temp_input_file(lines[0] + lines[1] + duplicate + lines[2])
+            main(['--input_file', TEMP_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT,
+                  '--checkpoint_file', checkpoint_file, '--resume'])
+
+            self.assertTrue(filecmp.cmp(output_file_path, EXAMPLE_OUTPUT))
+            self.assertFalse(os.path.exists(checkpoint_file))
+
+        finally:
+            for path in [TEMP_INPUT, checkpoint_file, output_file_path, output_file_path + '.tmp']:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_checkpoint_missing_input(self):
+        '''
+        This validates that a run with checkpoints failing before any checkpoint is saved leaves no
+        partial output behind
+        '''
+        checkpoint_file = TEMP_INPUT + '.checkpoint'
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        try:
+            main(['--input_file', 'missing.json', '--window_size', '10', '--output_file', TEMP_OUTPUT,
+                  '--checkpoint_file', checkpoint_file])
+            self.assertFalse(os.path.exists(output_file_path + '.tmp'))
+            self.assertFalse(os.path.exists(checkpoint_file))
+
+            # An invalid translation before the first checkpoint is due
+            self.create_temp_input_file('{"timestamp": "2018-12-26 18:23:19.903159"}\n')
+            main(['--input_file', TEMP_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT,
+                  '--checkpoint_file', checkpoint_file])
+            self.assertFalse(os.path.exists(output_file_path + '.tmp'))
+
+        finally:
+            for path in [TEMP_INPUT, checkpoint_file, output_file_path + '.tmp']:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_interrupted_run(self):
+        '''
+        This validates that a run interrupted outside follow mode leaves no output file behind, and says so
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+
+        def interrupted(*args, **kwargs):
+            yield ('{"date": "2018-12-26 18:11:00", "average_delivery_time": "0"}\n',)
+            raise KeyboardInterrupt
+
+        with mock.patch('unbabel_cli.format_average_runs', interrupted), self.assertLogs(level='INFO') as logs:
+            main(['--input_file', EXAMPLE_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT])
+        self.assertIn("Interrupted, no output file was written", logs.output[-1])
+        self.assertFalse(os.path.exists(output_file_path))
+        self.assertFalse(os.path.exists(output_file_path + '.tmp'))
+
+    def test_stats_summary(self):
+        '''
+        This validates the counters, stages and peak window depth written with --stats
+        '''
+        stats_file = TEMP_INPUT + '.stats'
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        with open(EXAMPLE_INPUT, 'r') as file:
+            lines = [line.rstrip('\n') + '\n' for line in file]
+
+        try:
+            self.create_temp_input_file(lines[0] + lines[0] + 'not a translation\n' + lines[1] + lines[2])
+            main(['--input_file', TEMP_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT,
+                  '--on_invalid', 'skip', '--stats', stats_file])
+            self.assertTrue(filecmp.cmp(output_file_path, EXAMPLE_OUTPUT))
+
+            with open(stats_file, 'r') as file:
+                summary = json.load(file)
+            self.assertEqual((summary['lines'], summary['translations'], summary['duplicates'], summary['invalid']), (5, 3, 1, 1))
+            self.assertEqual(list(summary['stages']), ['parse', 'window', 'output'])
+            self.assertEqual(summary['stages']['parse']['items'], 3)
+            # 18:11 and 18:15 are both inside the windows from 18:16 to 18:21
+            self.assertEqual(summary['peak_window_depth'], 2)
+
+        finally:
+            for path in [TEMP_INPUT, stats_file, output_file_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_merge_compressed_shards(self):
+        '''
+        This validates that sorted shards, compressed or not, given as a glob are merged into a single
+        sorted stream, with duplicates detected across shards
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        with open(EXAMPLE_INPUT, 'r') as file:
+            lines = [line.rstrip('\n') + '\n' for line in file]
+        redelivery = lines[0].replace('18:11:08.509654', '18:12:00.000000').replace('"duration": 20', '"duration": 999')
+        shards = {'temp_shard_0.json.gz': gzip.open, 'temp_shard_1.json.xz': lzma.open, 'temp_shard_2.json': open}
+
+        try:
+            for (shard, opener), shard_lines in zip(shards.items(), [[lines[0], lines[2]], [redelivery], [lines[1]]]):
+                with opener(shard, 'wt') as file:
+                    file.writelines(shard_lines)
+
+            main(['--input_file', 'temp_shard_*', '--window_size', '10', '--output_file', TEMP_OUTPUT])
+            self.assertTrue(filecmp.cmp(output_file_path, EXAMPLE_OUTPUT))
+
+        finally:
+            for path in list(shards) + [output_file_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_allowed_lateness(self):
+        '''
+        This validates that translations read out of order are put back in place within the allowed
+        lateness, and that later ones are dropped and written unchanged to the late file
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        late_file_path = os.path.join('outputs/', TEMP_INPUT + '.late')
+        stats_file = TEMP_INPUT + '.stats'
+        with open(EXAMPLE_INPUT, 'r') as file:
+            lines = [line.rstrip('\n') + '\n' for line in file]
+
+        try:
+            # The 18:11 translation is read after the 18:15 one
+            self.create_temp_input_file(lines[1] + lines[0] + lines[2])
+            main(['--input_file', TEMP_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT, '--allowed_lateness', '300'])
+            self.assertTrue(filecmp.cmp(output_file_path, EXAMPLE_OUTPUT))
+
+            main(['--input_file', TEMP_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT, '--allowed_lateness', '60',
+                  '--late_file', TEMP_INPUT + '.late', '--stats', stats_file, '--decoder', 'fast'])
+            with open(output_file_path, 'r') as file:
+                averages = [json.loads(line) for line in file]
+            self.assertEqual(averages[0], {"date": "2018-12-26 18:15:00", "average_delivery_time": "0"})
+            self.assertEqual(averages[-1], {"date": "2018-12-26 18:24:00", "average_delivery_time": "42.5"})
+
+            # Even the fields the fast decoder does not extract are kept
+            with open(late_file_path, 'r') as file:
+                self.assertEqual(file.read(), lines[0])
+            with open(stats_file, 'r') as file:
+                summary = json.load(file)
+            self.assertEqual((summary['lines'], summary['translations'], summary['late']), (3, 2, 1))
+
+        finally:
+            for path in [TEMP_INPUT, stats_file, output_file_path, late_file_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_range_with_index(self):
+        '''
+        This validates that a range of minutes is the same as in the full output, whether it is calculated
+        from the whole input, from the per minute aggregates of the index or from the lines it points to,
+        and that the index is rebuilt once the input changes
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        index_file = TEMP_INPUT + '.idx'
+        with open(EXAMPLE_INPUT, 'r') as file:
+            lines = [line.rstrip('\n') + '\n' for line in file]
+        with open(EXAMPLE_OUTPUT, 'r') as file:
+            expected = [line for line in file if '18:16' <= json.loads(line)['date'][11:16] <= '18:20']
+
+        def output(*arguments):
+            main(['--input_file', TEMP_INPUT, '--window_size', '10', '--output_file', TEMP_OUTPUT,
+                  '--from', '2018-12-26', '18:16', '--to', '18:20'] + list(arguments))
+            with open(output_file_path, 'r') as file:
+                return file.readlines()
+
+        try:
+            # The duplicate must be left out of the lines read through the index
+            self.create_temp_input_file(lines[0] + lines[1] + lines[0] + lines[2])
+            self.assertEqual(output(), expected)
+            self.assertFalse(os.path.exists(index_file))
+
+            self.assertEqual(output('--index'), expected)
+            self.assertTrue(os.path.exists(index_file))
+            with self.assertLogs(level='INFO') as logs:
+                self.assertEqual(output('--index'), expected)
+                self.assertEqual(output('--index', '--group_by', 'client_name'), [line.replace('"average', '"client_name": "airliberty", "average') for line in expected])
+            self.assertFalse(any('rebuilding' in message for message in logs.output))
+
+            # A translation within the range changes its averages
+            self.create_temp_input_file(lines[0] + lines[1] + lines[0] + lines[1].replace('18:15:19', '18:17:19').replace('a75aa4', 'a75aa6') + lines[2])
+            with self.assertLogs(level='INFO') as logs:
+                averages = output('--index')
+            self.assertTrue(any('rebuilding' in message for message in logs.output))
+            self.assertEqual(averages, output())
+            self.assertEqual(json.loads(averages[-1])['average_delivery_time'], '27.3333')
+
+        finally:
+            for path in [TEMP_INPUT, index_file, output_file_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_quantile_sketch_accuracy(self):
+        '''
+        This validates that sketch quantiles stay within the relative accuracy, and that
+        subtracting a merged sketch restores the original one
+        '''
+        sketch = QuantileSketch(0.01)
+        durations = [0] + [i * i for i in range(1, 1000)]
+        for duration in durations:
+            sketch.add(duration)
+
+        for q in [0, 0.5, 0.95, 0.99, 1]:
+            exact = durations[int(q * (len(durations) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), 0.01 * exact)
+
+        other = QuantileSketch(0.01)
+        other.add(5)
+        counts = dict(sketch.counts)
+        sketch.merge(other)
+        sketch.merge(other, -1)
+        self.assertEqual(sketch.counts, counts)
+        self.assertEqual(sketch.count, len(durations))
+
+    def test_quantile_sketch_negative_durations(self):
+        '''
+        This validates that negative durations are ranked below zero with the same relative accuracy,
+        so percentiles agree with the average of the same window
+        '''
+        sketch = QuantileSketch(0.01)
+        durations = [-i * i for i in range(1, 500)] + [0] + [i * i for i in range(1, 500)]
+        for duration in durations:
+            sketch.add(duration)
+
+        durations.sort()
+        for q in [0, 0.25, 0.5, 0.75, 1]:
+            exact = durations[int(q * (len(durations) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), 0.01 * abs(exact))
+
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        try:
+            self.create_temp_input_file(''.join('{"timestamp": "2018-12-26 18:11:%02d.509654","translation_id": "%s","source_language": "en","target_language": "fr","client_name": "airliberty","event_name": "translation_delivered","nr_words": 30, "duration": %d}\n' % (second, translation_id, duration)
+                                                for second, translation_id, duration in [(8, "a", -20), (9, "b", 40)]))
+            main(['--input_file', TEMP_INPUT, '--window_size', '10', '--percentiles', '0', '100', '--output_file', TEMP_OUTPUT])
+            with open(output_file_path, 'r') as file:
+                record = json.loads(file.readlines()[-1])
+            self.assertEqual(record['average_delivery_time'], '10')
+            self.assertAlmostEqual(float(record['p0_delivery_time']), -20, delta=0.2)
+            self.assertAlmostEqual(float(record['p100_delivery_time']), 40, delta=0.4)
+
+        finally:
+            for path in [TEMP_INPUT, output_file_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_percentile_window_averages_example(self):
+        '''
+        This validates that percentiles come with the usual moving averages using the given example
+        '''
+        output_file_path = os.path.join('outputs/', TEMP_OUTPUT)
+        try:
+            main(['--input_file', EXAMPLE_INPUT, '--window_size', '10', '--percentiles', '0', '100', '--output_file', TEMP_OUTPUT])
+            with open(output_file_path, 'r') as file:
+                lines = [json.loads(line) for line in file]
+            with open(EXAMPLE_OUTPUT, 'r') as file:
+                expected_lines = [json.loads(line) for line in file]
+
+            self.assertEqual([{key: line[key] for key in ("date", "average_delivery_time")} for line in lines], expected_lines)
+            self.assertEqual((lines[0]["p0_delivery_time"], lines[0]["p100_delivery_time"]), ("0", "0"))
+            # The window of 18:24 holds the durations 31 and 54
+            self.assertAlmostEqual(float(lines[-1]["p0_delivery_time"]), 31, delta=0.31)
+            self.assertAlmostEqual(float(lines[-1]["p100_delivery_time"]), 54, delta=0.54)
+
+        finally:
+            os.remove(output_file_path)
+
     # Comment out this test if running tests.py takes too long
     def test_full_integration_large_file(self):
         '''
         This validates that the program works well with large files.
         '''
+        if not os.path.exists(LARGE_INPUT):
+            # The large input is generated deterministically instead of being versioned
+            write_events(LARGE_INPUT, generate_events(rate=35, span=2880, gap_ratio=0.01, duplicate_ratio=0.01, boundary_ratio=0.01, seed=2018))
+        if not os.path.exists(LARGE_OUTPUT):
+            main(['--input_file', LARGE_INPUT, '--window_size', '15', '--output_file', os.path.basename(LARGE_OUTPUT)])
+
         translations = parse_input(LARGE_INPUT)
         moving_averages = calculate_moving_average(translations, 15)
 
@@ -277,6 +946,304 @@ class TestTranslationApp(unittest.TestCase):
         finally:
             os.remove(output_file_path)
 
+    def test_generate_events_deterministic(self):
+        '''
+        This validates that the generator always produces the same sorted events for the same seed.
+        '''
+        options = dict(rate=20, span=30, gap_ratio=0.1, gap_length=5, duplicate_ratio=0.2, boundary_ratio=0.1)
+        events = list(generate_events(seed=7, **options))
+
+        self.assertEqual(events, list(generate_events(seed=7, **options)))
+        self.assertNotEqual(events, list(generate_events(seed=8, **options)))
+        timestamps = [event["timestamp"] for event in events]
+        self.assertEqual(timestamps, sorted(timestamps))
+        translation_ids = {event["translation_id"] for event in events}
+        self.assertLess(len(translation_ids), len(events))
+
+        try:
+            self.assertEqual(write_events(TEMP_INPUT, events), len(events))
+            decoder = TranslationDecoder('fast')
+            # Redelivered translations are skipped
+            self.assertEqual(len(list(read_events(TEMP_INPUT, decoder=decoder))), len(translation_ids))
+            self.assertEqual(decoder.fallbacks, 0)
+
+        finally:
+            os.remove(TEMP_INPUT)
+
+
+class TestDuplicateFilter(unittest.TestCase):
+
+    def test_unbounded_horizon(self):
+        '''
+        This validates that without a horizon every id is remembered
+        '''
+        duplicate_filter = DuplicateFilter()
+        self.assertFalse(duplicate_filter.is_duplicate("a", 0))
+        self.assertFalse(duplicate_filter.is_duplicate("b", 10))
+        self.assertTrue(duplicate_filter.is_duplicate("a", 1_000_000))
+        self.assertEqual((duplicate_filter.hits, duplicate_filter.misses), (1, 2))
+
+    def test_horizon_expires_ids(self):
+        '''
+        This validates that ids are remembered for horizon minutes after they were last seen and then forgotten
+        '''
+        duplicate_filter = DuplicateFilter(horizon=5)
+        self.assertFalse(duplicate_filter.is_duplicate("a", 0))
+        self.assertFalse(duplicate_filter.is_duplicate("b", 3))
+        self.assertTrue(duplicate_filter.is_duplicate("a", 5))
+        self.assertFalse(duplicate_filter.is_duplicate("c", 6))
+
+        # The duplicate at minute 5 refreshed "a", so only the ids not seen within the horizon are forgotten
+        self.assertEqual(len(duplicate_filter), 3)
+        self.assertTrue(duplicate_filter.is_duplicate("a", 10))
+        self.assertFalse(duplicate_filter.is_duplicate("b", 10))
+        self.assertEqual(len(duplicate_filter), 3)
+        self.assertEqual((duplicate_filter.hits, duplicate_filter.misses), (2, 4))
+
+    def test_bloom_mode(self):
+        '''
+        This validates that Bloom filters detect duplicates within the horizon
+        with a false positive rate close to the requested one
+        '''
+        duplicate_filter = DuplicateFilter(horizon=10, mode='bloom', capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            duplicate_filter.is_duplicate(f"id-{i}", 0)
+        self.assertLess(duplicate_filter.hits, 30)
+
+        duplicate_filter.hits = 0
+        self.assertTrue(duplicate_filter.is_duplicate("id-7", 15))
+        self.assertFalse(duplicate_filter.is_duplicate("id-8", 25))
+
+    def test_save_and_load_state(self):
+        '''
+        This validates that a restored filter remembers the same ids and counters
+        '''
+        for options in [{'horizon': 5}, {'horizon': 5, 'mode': 'bloom', 'capacity': 100}]:
+            duplicate_filter = DuplicateFilter(**options)
+            for minute, translation_id in enumerate(["a", "b", "a", "c"]):
+                duplicate_filter.is_duplicate(translation_id, minute)
+            stream = io.BytesIO()
+            duplicate_filter.save_state(stream)
+
+            restored = DuplicateFilter(**options)
+            stream.seek(0)
+            restored.load_state(stream)
+            self.assertEqual((restored.hits, restored.misses), (1, 3))
+            self.assertTrue(restored.is_duplicate("b", 4))
+            self.assertFalse(restored.is_duplicate("d", 4))
+
+class TestRateLimitedLog(unittest.TestCase):
+
+    def test_burst_then_summary(self):
+        log = RateLimitedLog("Occurrence %d", "%d more occurrences", interval=3600, burst=2)
+        with self.assertLogs(level='INFO') as logs:
+            for i in range(5):
+                log(i)
+            log.flush()
+            log.flush()
+
+        self.assertEqual([record.getMessage() for record in logs.records], ["Occurrence 0", "Occurrence 1", "3 more occurrences"])
+        self.assertEqual(log.count, 5)
+
+    def test_new_interval_logs_again(self):
+        log = RateLimitedLog("Occurrence %d", "%d more occurrences", interval=0, burst=1)
+        with self.assertLogs(level='INFO') as logs:
+            for i in range(3):
+                log(i)
+
+        self.assertEqual([record.getMessage() for record in logs.records], ["Occurrence 0", "Occurrence 1", "Occurrence 2"])
+
+
+class TestReorderBuffer(unittest.TestCase):
+
+    def test_sorts_within_allowed_lateness(self):
+        '''
+        This validates that translations up to the allowed lateness are sorted, with ties in the order
+        they are read, and that the buffer holds no more than the translations within the lateness
+        '''
+        timestamps = [10, 5, 20, 12, 20, 15, 40, 39]
+        translations = [({'index': index}, timestamp * 1_000_000, b'') for index, timestamp in enumerate(timestamps)]
+        reorder_buffer = ReorderBuffer(10)
+
+        reordered = [(translation['index'], timestamp // 1_000_000) for translation, timestamp in reorder_buffer.reorder(translations)]
+        self.assertEqual(reordered, [(1, 5), (0, 10), (3, 12), (5, 15), (2, 20), (4, 20), (7, 39), (6, 40)])
+        self.assertEqual(reorder_buffer.late, 0)
+        self.assertEqual(reorder_buffer.peak_depth, 5)
+
+    def test_late_translations(self):
+        '''
+        This validates that translations older than the watermark are counted and handed to on_late
+        along with their input line, and that without lateness sorted translations pass through one by one
+        '''
+        late = []
+        reorder_buffer = ReorderBuffer(1, lambda translation, timestamp, line: late.append((translation, line)))
+        translations = [('a', 5_000_000, b'A'), ('b', 3_000_000, b'B'), ('c', 4_000_000, b'C'), ('d', 4_000_000, b'D')]
+        self.assertEqual(list(reorder_buffer.reorder(translations)), [('c', 4_000_000), ('d', 4_000_000), ('a', 5_000_000)])
+        self.assertEqual((reorder_buffer.late, late), (1, [('b', b'B')]))
+
+        reorder_buffer = ReorderBuffer(0)
+        translations = [('a', 1), ('b', 1), ('c', 2)]
+        self.assertEqual(list(reorder_buffer.reorder(translation + (b'',) for translation in translations)), translations)
+        self.assertEqual(reorder_buffer.peak_depth, 1)
+
+class TestMinuteRing(unittest.TestCase):
+
+    def setUp(self):
+        translations = generate_events(rate=5, span=60, gap_ratio=0.1, gap_length=8, boundary_ratio=0.2, seed=3)
+        self.events = [(parse_timestamp(translation['timestamp']), translation['duration']) for translation in translations]
+
+    def test_matches_stream_moving_average(self):
+        '''
+        This validates that a ring barely longer than the window, whose slots are reused many times,
+        gives the same averages as the batch calculation
+        '''
+        ring = MinuteRing(6)
+        averages = []
+        next_minute = None
+
+        def record(minute):
+            return {"date": format_minute(minute), "average_delivery_time": f'{ring.average(minute, 5):g}'}
+
+        for timestamp, duration in self.events:
+            # The minutes up to this event's only depend on the events already added
+            while next_minute is not None and next_minute <= timestamp // 60_000_000:
+                averages.append(record(next_minute))
+                next_minute += 1
+            ring.add(timestamp, duration)
+            if next_minute is None:
+                next_minute = ring.latest
+        averages.append(record(next_minute))
+
+        self.assertEqual(averages, list(stream_moving_average(self.events, 5)))
+
+    def test_events_out_of_order(self):
+        '''
+        This validates that the arrival order of events inside the ring does not change the averages,
+        and that events older than the ring are rejected
+        '''
+        ordered, shuffled = MinuteRing(100), MinuteRing(100)
+        for timestamp, duration in self.events:
+            ordered.add(timestamp, duration)
+        events = self.events[:]
+        random.Random(0).shuffle(events)
+        for timestamp, duration in events:
+            shuffled.add(timestamp, duration)
+
+        for minute in range(ordered.oldest + 10, ordered.latest + 2):
+            self.assertEqual(shuffled.average(minute, 10), ordered.average(minute, 10))
+        self.assertFalse(ordered.add((ordered.oldest - 1) * 60_000_000 + 1, 10))
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "UNIX sockets are not available")
+class TestAggregationServer(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.unix_socket = os.path.join(self.temp_dir, 'server.sock')
+        self.server = AggregationServer(history=60)
+
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.server.serve(unix_socket=self.unix_socket, ready=ready.set))
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+        ready.wait(5)
+
+    def serve(self):
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join(5)
+        self.loop.close()
+        os.rmdir(self.temp_dir)
+
+    def test_concurrent_producers_and_queries(self):
+        '''
+        This validates that events sent over concurrent connections are aggregated into the same moving
+        averages as the batch output
+        '''
+        with open(EXAMPLE_INPUT, 'rb') as file:
+            lines = [line.rstrip(b'\n') for line in file]
+        with open(EXAMPLE_OUTPUT, 'r') as file:
+            expected = [json.loads(line) for line in file]
+
+        producers = [threading.Thread(target=send_events, args=([line, line],), kwargs={'unix_socket': self.unix_socket}) for line in lines]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+
+        # Wait until the server has read every connection
+        for _ in range(100):
+            stats = query('STATS', unix_socket=self.unix_socket)
+            if stats['translations'] + stats['duplicates'] == 6:
+                break
+            time.sleep(0.05)
+        self.assertEqual((stats['translations'], stats['duplicates']), (3, 3))
+
+        self.assertEqual(query('AVG 10', unix_socket=self.unix_socket), expected[-1])
+        self.assertEqual(query('AVG 10 2018-12-26 18:16', unix_socket=self.unix_socket), expected[5])
+        self.assertIn('error', query('AVG 61', unix_socket=self.unix_socket))
+        self.assertIn('error', query('MEDIAN 10', unix_socket=self.unix_socket))
+
+
+class TestTranslationDecoder(unittest.TestCase):
+
+    LINE = '{"timestamp": "2018-12-26 18:11:08.509654","translation_id": "5aa5b2f39f7254a75aa5","source_language": "en","target_language": "fr","client_name": "airliberty","event_name": "translation_delivered","nr_words": 30, "duration": 20}\n'
+
+    def test_fast_mode_matches_json_mode(self):
+        '''
+        This validates that the fast path accepts and extracts exactly what full JSON parsing does,
+        falling back to it for lines in another layout
+        '''
+        lines = [self.LINE,
+                 self.LINE.replace('","', '", "'),
+                 self.LINE.replace('"client_name": "airliberty"', '"client_name": "air\\u0142iberty"'),
+                 self.LINE.replace('"nr_words": 30, "duration": 20', '"duration": 20, "nr_words": 30'),
+                 self.LINE.replace('"duration": 20', '"duration": 020'),
+                 self.LINE.replace('"duration": 20', '"duration": 20.0'),
+                 self.LINE.replace('"nr_words": 30', '"nr_words": "30"'),
+                 self.LINE.replace('18:11:08', '18:71:08'),
+                 '[]\n']
+
+        for line in lines:
+            results = []
+            for mode in TranslationDecoder.MODES:
+                decoder = TranslationDecoder(mode, 'skip', fields=['client_name'])
+                decoded = decoder.decode(line.encode())
+                if decoded is not None:
+                    translation, timestamp = decoded
+                    decoded = (timestamp, translation['translation_id'], translation['duration'], translation['client_name'])
+                results.append((decoded, decoder.invalid))
+            self.assertEqual(results[0], results[1], line)
+
+        decoder = TranslationDecoder('fast')
+        for line in lines[:4]:
+            decoder.decode(line.encode())
+        self.assertEqual((decoder.fast_decoded, decoder.fallbacks), (2, 2))
+
+    def test_skip_invalid_lines(self):
+        '''
+        This validates that with the skip policy invalid lines are counted and the valid ones still read
+        '''
+        try:
+            with open(TEMP_INPUT, 'w') as file:
+                file.write(self.LINE + '{"timestamp": \n' + self.LINE.replace('"duration": 20', '"duration": "20"') + self.LINE.replace('5aa5', '6aa5'))
+
+            for mode in TranslationDecoder.MODES:
+                decoder = TranslationDecoder(mode, 'skip')
+                self.assertEqual(len(list(read_events(TEMP_INPUT, decoder=decoder))), 2)
+                self.assertEqual(decoder.invalid, 2)
+
+                with self.assertRaises(InputError):
+                    list(read_events(TEMP_INPUT, decoder=TranslationDecoder(mode, 'abort')))
+
+        finally:
+            os.remove(TEMP_INPUT)
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,130 +1,2576 @@
 import argparse
+from array import array
+from bisect import bisect_left
+import bz2
 import json
 from datetime import datetime, timedelta
 from collections import deque
+from functools import lru_cache, partial
+import glob
+import gzip
+import heapq
+from itertools import chain
+import hashlib
+import io
 import logging
+import lzma
+import math
+import mmap
+from multiprocessing import Pool
+from operator import itemgetter
 import os
+import re
+import struct
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s',
                     handlers=[logging.StreamHandler()])
 
-def parse_input(file_path):
+# Timestamps are handled internally as integer microseconds since EPOCH
+EPOCH = datetime(1970, 1, 1)
+MICROSECONDS_PER_MINUTE = 60_000_000
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Microseconds since EPOCH of each "YYYY-MM-DD HH" prefix parsed so far
+_hour_cache = {}
+
+def parse_timestamp(timestamp):
+    '''
+    Convert a "%Y-%m-%d %H:%M:%S.%f" timestamp into microseconds since EPOCH.
+
+    Timestamps in the usual fixed width layout are sliced, and the date and hour are only
+    validated by datetime the first time they are seen. Anything else falls back to strptime.
+
+    Parameters:
+        timestamp -> str: The timestamp to convert.
+
+    Returns:
+        int: The number of microseconds since EPOCH.
+
+    Raises:
+        ValueError: If the timestamp does not match the format.
+    '''
+    if len(timestamp) == 26 and timestamp[13] == ':' and timestamp[16] == ':' and timestamp[19] == '.':
+        hour = _hour_cache.get(timestamp[:13])
+        if hour is None:
+            hour = _parse_hour(timestamp[:13])
+
+        minutes, seconds, microseconds = timestamp[14:16], timestamp[17:19], timestamp[20:]
+        if hour is not None and (minutes + seconds + microseconds).isascii() and (minutes + seconds + microseconds).isdigit():
+            minutes, seconds = int(minutes), int(seconds)
+            if minutes < 60 and seconds < 60:
+                return hour + (minutes * 60 + seconds) * 1_000_000 + int(microseconds)
+
+    # The general parser also raises the error for invalid timestamps
+    return to_timestamp(datetime.strptime(timestamp, TIMESTAMP_FORMAT))
+
+def _parse_hour(prefix):
+    '''
+    Convert and cache a "YYYY-MM-DD HH" prefix, returning None if it is not in that exact layout.
+    '''
+    if not (prefix.isascii() and prefix[4] == prefix[7] == '-' and prefix[10] == ' '
+            and (prefix[:4] + prefix[5:7] + prefix[8:10] + prefix[11:]).isdigit()):
+        return None
+
+    try:
+        hour = to_timestamp(datetime(int(prefix[:4]), int(prefix[5:7]), int(prefix[8:10]), int(prefix[11:])))
+    except ValueError:
+        return None
+
+    # The input is sorted, so old hours are rarely needed again
+    if len(_hour_cache) >= 4096:
+        _hour_cache.clear()
+    _hour_cache[prefix] = hour
+    return hour
+
+def to_timestamp(date):
+    '''
+    Convert a datetime into microseconds since EPOCH.
+    '''
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+@lru_cache(maxsize=1024)
+def _format_hour(hour):
+    return (EPOCH + timedelta(hours=hour)).strftime("%Y-%m-%d %H:")
+
+def format_minute(minute):
+    '''
+    Format a minute, counted from EPOCH, as "%Y-%m-%d %H:%M:%S".
+    '''
+    return f'{_format_hour(minute // 60)}{minute % 60:02d}:00'
+
+# "%M:%S" of each minute of an hour
+_MINUTE_SUFFIXES = [f'{minute:02d}:00' for minute in range(60)]
+
+class BloomFilter:
+    '''
+    Fixed-size probabilistic set of strings.
+
+    Membership tests may report false positives, at a rate of about error_rate as long as
+    no more than capacity items are added, but never false negatives.
+    '''
+
+    def __init__(self, capacity, error_rate):
+        # Optimal number of bits and hash functions for the requested capacity and error rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: derive every position from two independent 64 bit hashes
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+class DuplicateFilter:
+    '''
+    Detect repeated translation ids: a translation is a duplicate if its id was seen within the last
+    horizon minutes. Every sighting, duplicate or not, refreshes the id, so whether a translation is
+    a duplicate only depends on the translations of the horizon before it, and replaying them (as the
+    worker processes of read_buckets_parallel() do) gives exactly the same decisions.
+
+    Since the input is sorted by timestamp, ids are grouped into one bucket per minute and whole
+    buckets are expired once they fall out of the horizon, forgetting the ids not seen since, so
+    memory is bounded by the number of translations within the horizon. Without a horizon every id
+    is remembered forever.
+
+    In 'bloom' mode ids are kept in Bloom filters instead, one per horizon-long generation, of
+    which only the current and the previous ones are kept. Memory is then fixed by capacity no
+    matter how long the stream is, at the cost of wrongly reporting about error_rate of the unique
+    translations as duplicates while a generation holds at most capacity ids.
+
+    Attributes:
+        hits -> int: Number of translations reported as duplicates.
+        misses -> int: Number of translations seen for the first time.
+    '''
+
+    MODES = ('exact', 'bloom')
+
+    def __init__(self, horizon=None, mode='exact', capacity=1_000_000, error_rate=0.001):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown duplicate detection mode: {mode}")
+
+        self.horizon = horizon
+        self.mode = mode
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.hits = 0
+        self.misses = 0
+
+        # Exact mode: every remembered id (with a horizon, mapped to the last minute it was seen in),
+        # plus the ids seen in each minute in order to expire them
+        self._ids = set() if horizon is None else {}
+        self._buckets = deque()
+
+        # Bloom mode: filters for the current and the previous generations
+        self._generation = None
+        self._filters = []
+
+    def is_duplicate(self, translation_id, minute):
+        '''
+        Check whether a translation id has already been seen, remembering it otherwise.
+
+        Parameters:
+            translation_id -> str: The id of the translation.
+            minute -> int: The minute of the translation, counted from EPOCH. Must not decrease between calls.
+
+        Returns:
+            bool: True if the id was seen within the horizon, False otherwise.
+        '''
+        if self.mode == 'bloom':
+            duplicate = self._check_bloom(translation_id, minute)
+        else:
+            duplicate = self._check_exact(translation_id, minute)
+
+        if duplicate:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return duplicate
+
+    def replay_start(self, minute):
+        '''
+        The first minute whose translations can change the decisions from minute onwards, so that replaying
+        the translations from it up to minute restores the state of a filter that saw every translation.
+        '''
+        if self.mode == 'bloom':
+            # The start of the previous generation
+            return (minute // self.horizon - 1) * self.horizon
+        return minute - self.horizon
+
+    def _check_exact(self, translation_id, minute):
+        if self.horizon is None:
+            if translation_id in self._ids:
+                return True
+            self._ids.add(translation_id)
+            return False
+
+        # Expire the buckets of the minutes that fell out of the horizon, forgetting the ids not seen since
+        while self._buckets and self._buckets[0][0] < minute - self.horizon:
+            expired_minute, translation_ids = self._buckets.popleft()
+            for expired_id in translation_ids:
+                if self._ids.get(expired_id) == expired_minute:
+                    del self._ids[expired_id]
+
+        duplicate = translation_id in self._ids
+        self._ids[translation_id] = minute
+        if not self._buckets or self._buckets[-1][0] != minute:
+            self._buckets.append((minute, []))
+        self._buckets[-1][1].append(translation_id)
+        return duplicate
+
+    def _check_bloom(self, translation_id, minute):
+        generation = 0 if self.horizon is None else minute // self.horizon
+        if generation != self._generation:
+            # Keep the previous generation only if it is adjacent, so ids live at least a full horizon
+            previous = self._filters[-1:] if self._generation == generation - 1 else []
+            self._filters = previous + [BloomFilter(self.capacity, self.error_rate)]
+            self._generation = generation
+
+        duplicate = any(translation_id in bloom_filter for bloom_filter in self._filters)
+        self._filters[-1].add(translation_id)
+        return duplicate
+
+    def __len__(self):
+        '''
+        Number of ids currently remembered in exact mode.
+        '''
+        return len(self._ids)
+
+    def save_state(self, stream):
+        '''
+        Write the remembered ids and the counters to a binary stream, for checkpoints.
+        '''
+        _write_struct(stream, '<QQ', self.hits, self.misses)
+
+        if self.mode == 'bloom':
+            _write_struct(stream, '<?qB', self._generation is not None, self._generation or 0, len(self._filters))
+            for bloom_filter in self._filters:
+                _write_struct(stream, '<Q', len(bloom_filter.bits))
+                stream.write(bloom_filter.bits)
+            return
+
+        buckets = self._buckets if self.horizon is not None else [(0, self._ids)]
+        _write_struct(stream, '<I', len(buckets))
+        for minute, translation_ids in buckets:
+            _write_struct(stream, '<qI', minute, len(translation_ids))
+            for translation_id in translation_ids:
+                encoded = translation_id.encode()
+                _write_struct(stream, '<I', len(encoded))
+                stream.write(encoded)
+
+    def load_state(self, stream):
+        '''
+        Restore the state written by save_state() with the same horizon, mode, capacity and error rate.
+        '''
+        self.hits, self.misses = _read_struct(stream, '<QQ')
+
+        if self.mode == 'bloom':
+            has_generation, generation, filter_count = _read_struct(stream, '<?qB')
+            self._generation = generation if has_generation else None
+            self._filters = []
+            for _ in range(filter_count):
+                bloom_filter = BloomFilter(self.capacity, self.error_rate)
+                bloom_filter.bits = bytearray(_read_bytes(stream, _read_struct(stream, '<Q')[0]))
+                if len(bloom_filter.bits) != (bloom_filter.size + 7) // 8:
+                    raise ValueError("Bloom filter size does not match the capacity and error rate")
+                self._filters.append(bloom_filter)
+            return
+
+        self._ids = set() if self.horizon is None else {}
+        self._buckets = deque()
+        for _ in range(_read_struct(stream, '<I')[0]):
+            minute, id_count = _read_struct(stream, '<qI')
+            translation_ids = [_read_bytes(stream, _read_struct(stream, '<I')[0]).decode() for _ in range(id_count)]
+            if self.horizon is None:
+                self._ids.update(translation_ids)
+            else:
+                # Later buckets hold the last minute each id was seen in
+                self._ids.update(dict.fromkeys(translation_ids, minute))
+                self._buckets.append((minute, translation_ids))
+
+# Translation fields the moving averages can be grouped by
+GROUP_FIELDS = ('client_name', 'source_language', 'target_language', 'event_name')
+
+class InputError(Exception):
+    '''
+    Raised when the input file cannot be read or contains an invalid translation.
+    The cause has already been logged by the time this is raised.
+    '''
+
+# Keys of a translation and the types of their values
+TRANSLATION_TYPES = {
+    "timestamp": str,
+    "translation_id": str,
+    "source_language": str,
+    "target_language": str,
+    "client_name": str,
+    "event_name": str,
+    "nr_words": int,
+    "duration": int
+}
+_TRANSLATION_KEYS = TRANSLATION_TYPES.keys()
+
+# Lines in the layout the input is written in, with the keys in their usual order and strings without
+# escapes. Any line matching it is a valid translation, so it needs neither json.loads nor validation
+_FAST_TRANSLATION = re.compile(
+    rb'\{"timestamp": ?"(?P<timestamp>[^"\\\x00-\x1f]*)"'
+    rb', ?"translation_id": ?"(?P<translation_id>[^"\\\x00-\x1f]*)"'
+    rb', ?"source_language": ?"(?P<source_language>[^"\\\x00-\x1f]*)"'
+    rb', ?"target_language": ?"(?P<target_language>[^"\\\x00-\x1f]*)"'
+    rb', ?"client_name": ?"(?P<client_name>[^"\\\x00-\x1f]*)"'
+    rb', ?"event_name": ?"(?P<event_name>[^"\\\x00-\x1f]*)"'
+    rb', ?"nr_words": ?-?(?:0|[1-9][0-9]*)'
+    rb', ?"duration": ?(?P<duration>-?(?:0|[1-9][0-9]*))\}[ \t\r\n]*'
+)
+
+def _translation_error(translation):
+    '''
+    Describe what makes a decoded translation invalid, or return None if it is valid.
+    '''
+    if not isinstance(translation, dict):
+        return "Not a JSON object"
+    if translation.keys() != _TRANSLATION_KEYS:
+        return "Set of keys different than expected"
+    for key, expected_type in TRANSLATION_TYPES.items():
+        if not isinstance(translation[key], expected_type):
+            return f"Incorrect data type for key '{key}'"
+    return None
+
+class TranslationDecoder:
+    '''
+    Decode and validate the lines of the input.
+
+    In 'fast' mode, lines in the layout the input is written in are matched by a precompiled pattern
+    that only accepts valid translations, and only the timestamp, the translation id, the duration and
+    the given fields are extracted from them. Any other line falls back to json.loads and validation,
+    so both modes accept exactly the same lines.
+
+    With on_invalid 'skip', invalid lines are counted and skipped instead of aborting the run.
+
+    Attributes:
+        fast_decoded -> int: Number of lines decoded by the fast path.
+        fallbacks -> int: Number of lines the fast path could not decode.
+        invalid -> int: Number of invalid lines skipped.
+    '''
+
+    MODES = ('json', 'fast')
+    POLICIES = ('abort', 'skip')
+
+    def __init__(self, mode='json', on_invalid='abort', fields=()):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown decoding mode: {mode}")
+        if on_invalid not in self.POLICIES:
+            raise ValueError(f"Unknown invalid line policy: {on_invalid}")
+
+        self.mode = mode
+        self.on_invalid = on_invalid
+        self.fast_decoded = 0
+        self.fallbacks = 0
+        self.invalid = 0
+        self._fields = ('timestamp', 'translation_id', 'duration') + tuple(fields)
+
+    def decode(self, line):
+        '''
+        Decode and validate a line of the input.
+
+        Parameters:
+            line -> bytes: The line.
+
+        Returns:
+            tuple: The translation and its timestamp in microseconds since EPOCH, or None if the line is
+                   invalid and skipped. In 'fast' mode the translation may only hold the extracted fields.
+
+        Raises:
+            InputError: If the translation is invalid and on_invalid is 'abort'. The cause is logged.
+            ValueError: If the line is not JSON or its timestamp is invalid and on_invalid is 'abort'.
+        '''
+        try:
+            translation = self._fast_decode(line) if self.mode == 'fast' else None
+            if translation is None:
+                translation = json.loads(line)
+                problem = _translation_error(translation)
+                if problem is not None:
+                    if self.on_invalid == 'abort':
+                        logging.error("%s in translation: %s", problem, translation)
+                        raise InputError("Invalid translation")
+                    raise ValueError(problem)
+
+            return translation, parse_timestamp(translation['timestamp'])
+
+        except ValueError as e:
+            if self.on_invalid == 'abort':
+                raise
+            self.invalid += 1
+            logging.debug("Skipping invalid line %r: %s", line, e)
+            return None
+
+    def _fast_decode(self, line):
+        match = _FAST_TRANSLATION.fullmatch(line)
+        if match is None:
+            self.fallbacks += 1
+            return None
+
+        self.fast_decoded += 1
+        translation = dict(zip(self._fields, [value.decode() for value in match.group(*self._fields)]))
+        translation['duration'] = int(translation['duration'])
+        return translation
+
+# Decompressors of the compressed input formats, by file extension
+COMPRESSED_INPUTS = {
+    '.gz': gzip.GzipFile,
+    '.xz': lzma.LZMAFile,
+    '.bz2': bz2.BZ2File,
+}
+
+# Buffer size of the input files, so that lines are split out of large blocks of (decompressed) data
+INPUT_BUFFER_SIZE = 1 << 20
+
+def is_compressed(file_path):
+    return os.path.splitext(file_path)[1] in COMPRESSED_INPUTS
+
+def open_input(file_path):
+    '''
+    Open an input file for reading in binary mode, decompressing it on the fly if its extension is one
+    of COMPRESSED_INPUTS. Reads go through a large buffer, so the data is decompressed in large blocks
+    rather than a few kilobytes at a time, and nothing is ever written to disk.
+
+    Parameters:
+        file_path -> str: The path to the file.
+
+    Returns:
+        file: The file, which can be iterated over line by line. Compressed files can only seek slowly,
+              by decompressing everything before the offset sought.
+    '''
+    decompressor = COMPRESSED_INPUTS.get(os.path.splitext(file_path)[1])
+    if decompressor is None:
+        return open(file_path, 'rb', buffering=INPUT_BUFFER_SIZE)
+    return io.BufferedReader(decompressor(file_path), INPUT_BUFFER_SIZE)
+
+def _read_lines(input_file, start=0, end=None):
+    '''
+    Yield the lines of a binary file starting at byte offset start, which must be the start of a line,
+    and stopping at the first line that starts at or after end.
+    '''
+    input_file.seek(start)
+    if end is None:
+        yield from input_file
+        return
+
+    position = start
+    for line in input_file:
+        if position >= end:
+            return
+        position += len(line)
+        yield line
+
+def _file_lines(file_path, start=0, end=None):
+    '''
+    Yield the lines of a file between the byte offsets start and end, as _read_lines() does.
+    '''
+    with open_input(file_path) as input_file:
+        yield from _read_lines(input_file, start, end)
+
+def follow_lines(file_path, poll_interval=1.0, idle_timeout=None):
+    '''
+    Yield the lines of a file that is still being written to, like tail -f, starting from its beginning.
+
+    Once the end of the file is reached, it is polled every poll_interval seconds for new lines,
+    sleeping in between. A line is only yielded once its newline has been written. If the file is
+    replaced (e.g. rotated by a log manager) or truncated, the rest of the old file is read before
+    following the new one from its beginning.
+
+    Parameters:
+        file_path -> str: The path to the file.
+        poll_interval -> float: Seconds to wait between checks for new lines (optional).
+        idle_timeout -> float: Stop after this many seconds without new lines (optional). Defaults to following forever.
+
+    Yields:
+        line -> bytes: Each complete line of the file.
+    '''
+    input_file = open(file_path, 'rb')
+    partial_line = b''
+    idle_since = time.monotonic()
+
+    try:
+        while True:
+            line = input_file.readline()
+            if line:
+                idle_since = time.monotonic()
+                if line.endswith(b'\n'):
+                    yield partial_line + line
+                    partial_line = b''
+                else:
+                    # The rest of the line has not been written yet
+                    partial_line += line
+                continue
+
+            # At the end of the file: check whether it was replaced or truncated
+            try:
+                status = os.stat(file_path)
+            except FileNotFoundError:
+                status = None
+            replaced = status is not None and status.st_ino != os.fstat(input_file.fileno()).st_ino
+            truncated = status is not None and not replaced and status.st_size < input_file.tell()
+
+            if replaced or truncated:
+                # Nothing more will be written to the old file, so its last line is complete
+                if partial_line:
+                    yield partial_line
+                    partial_line = b''
+                input_file.close()
+                input_file = open(file_path, 'rb')
+                continue
+
+            if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                if partial_line:
+                    yield partial_line
+                return
+            time.sleep(poll_interval)
+
+    finally:
+        input_file.close()
+
+class RateLimitedLog:
+    '''
+    Log a message at most burst times per interval seconds. Further occurrences in the interval are only
+    counted, and their number is logged once the interval is over or on flush(). Arguments are only
+    formatted into the messages actually logged, so an occurrence that is only counted costs a clock read.
+
+    Parameters:
+        message -> str: The message, with %-style placeholders for the arguments of each occurrence.
+        summary -> str: The message logged for the occurrences not logged, with a %d placeholder for their number.
+        level -> int: The logging level of the messages (optional).
+        interval -> float: The length of an interval in seconds (optional).
+        burst -> int: The number of occurrences logged per interval (optional).
+
+    Attributes:
+        count -> int: Number of occurrences so far.
+    '''
+
+    def __init__(self, message, summary, level=logging.INFO, interval=1.0, burst=5):
+        self.message = message
+        self.summary = summary
+        self.level = level
+        self.interval = interval
+        self.burst = burst
+        self.count = 0
+        self._logged = 0
+        self._suppressed = 0
+        self._interval_end = -math.inf
+
+    def __call__(self, *args):
+        self.count += 1
+        now = time.monotonic()
+        if now >= self._interval_end:
+            self.flush()
+            self._interval_end = now + self.interval
+            self._logged = 0
+
+        if self._logged < self.burst:
+            self._logged += 1
+            logging.log(self.level, self.message, *args)
+        else:
+            self._suppressed += 1
+
+    def flush(self):
+        '''
+        Log the number of occurrences not logged so far, if any.
+        '''
+        if self._suppressed:
+            logging.log(self.level, self.summary, self._suppressed)
+            self._suppressed = 0
+
+class ReorderBuffer:
+    '''
+    Sort translations that are only roughly sorted by timestamp, such as those of several producers
+    appending to the same feed, without sorting the whole input.
+
+    The watermark trails the latest timestamp read by allowed_lateness. Translations are held in a heap
+    until the watermark passes them, so those read out of order are put back in place as long as they are
+    no later than allowed_lateness. Translations older than the watermark are late: they are counted and
+    dropped, or handed to on_late. Ties are kept in the order they are read.
+
+    Parameters:
+        allowed_lateness -> float: Seconds a translation can lag behind the latest one read.
+        on_late -> callable: Called with each late translation, its timestamp and the input line it was decoded from (optional).
+
+    Attributes:
+        late -> int: Number of late translations dropped.
+        peak_depth -> int: Largest number of translations held at once.
+    '''
+
+    def __init__(self, allowed_lateness, on_late=None):
+        if allowed_lateness < 0:
+            raise ValueError("Allowed lateness must not be negative")
+
+        self.allowed_lateness = round(allowed_lateness * 1_000_000)
+        self.on_late = on_late
+        self.late = 0
+        self.peak_depth = 0
+
+    def reorder(self, translations):
+        '''
+        Lazily sort translations read out of order by at most the allowed lateness.
+
+        Parameters:
+            translations -> iterable: (translation, timestamp, line) tuples, with timestamps in microseconds since EPOCH
+                                      and the input lines the translations were decoded from.
+
+        Yields:
+            tuple: The (translation, timestamp) tuples sorted by timestamp, apart from the late ones.
+        '''
+        heap = []
+        sequence = 0
+        watermark = -math.inf
+        log_late = RateLimitedLog("Late translation dropped: %s", "%d more late translations dropped", logging.WARNING)
+
+        try:
+            for translation, timestamp, line in translations:
+                if timestamp < watermark:
+                    self.late += 1
+                    log_late(translation)
+                    if self.on_late is not None:
+                        self.on_late(translation, timestamp, line)
+                    continue
+
+                heapq.heappush(heap, (timestamp, sequence, translation))
+                sequence += 1
+                if len(heap) > self.peak_depth:
+                    self.peak_depth = len(heap)
+
+                # No translation read from now on can be placed before the watermark
+                watermark = max(watermark, timestamp - self.allowed_lateness)
+                while heap and heap[0][0] <= watermark:
+                    timestamp, _, translation = heapq.heappop(heap)
+                    yield translation, timestamp
+
+            while heap:
+                timestamp, _, translation = heapq.heappop(heap)
+                yield translation, timestamp
+
+        finally:
+            log_late.flush()
+
+def _decode_lines(lines, decoder, keep_lines=False):
+    for line in lines:
+        decoded = decoder.decode(line)
+        # Invalid lines skipped by the decoder are None
+        if decoded is not None:
+            yield decoded + (line,) if keep_lines else decoded
+
+def _read_translations(file_path, duplicate_filter, start=0, end=None, lines=None, decoder=None, reorder_buffer=None):
+    '''
+    Lazily parse the input JSON file, or the lines between the byte offsets start and end, yielding
+    each validated, non duplicate translation along with its timestamp in microseconds since EPOCH.
+    The lines can also come from another source, such as follow_lines(). They are decoded by decoder,
+    which defaults to json.loads and aborting on the first invalid translation.
+
+    file_path may also be a list of files, each sorted by timestamp, such as shards of the same stream.
+    Each file is decoded on its own and the decoded translations are merged by timestamp with a heap,
+    so duplicates are detected in a single sorted stream. Ties are broken in the order of the files.
+
+    With a reorder_buffer, the translations only need to be roughly sorted: they are sorted by the
+    buffer before duplicates are detected, and the late ones are dropped. Their input lines are kept
+    along until then, so that the late ones can be handed over unchanged.
+
+    Raises:
+        InputError: If a file cannot be read or one of its translations is invalid.
+    '''
+
+    if decoder is None:
+        decoder = TranslationDecoder()
+    file_paths = [file_path] if isinstance(file_path, str) else file_path
+    keep_lines = reorder_buffer is not None
+    if lines is not None:
+        translations = _decode_lines(lines, decoder, keep_lines)
+    elif len(file_paths) == 1:
+        translations = _decode_lines(_file_lines(file_paths[0], start, end), decoder, keep_lines)
+    else:
+        translations = heapq.merge(*(_decode_lines(_file_lines(path), decoder, keep_lines) for path in file_paths), key=itemgetter(1))
+    if reorder_buffer is not None:
+        translations = reorder_buffer.reorder(translations)
+    log_duplicate = RateLimitedLog("Duplicate translation detected: %s", "%d more duplicate translations detected")
+
+    try:
+        for translation, timestamp in translations:
+            # Check for duplicate translations. We ignore duplicates and continue
+            if duplicate_filter.is_duplicate(translation['translation_id'], timestamp // MICROSECONDS_PER_MINUTE):
+                log_duplicate(translation)
+                continue
+
+            yield translation, timestamp
+
+    except InputError:
+        raise
+    except FileNotFoundError as e:
+        logging.error(f"File {e.filename} not found.")
+        raise InputError(f"File {e.filename} not found") from None
+    except ValueError:
+        logging.error(f"Invalid timestamp format in {', '.join(file_paths)}.")
+        raise InputError(f"Invalid timestamp format in {', '.join(file_paths)}") from None
+    except Exception as e:
+        logging.error(f"An unexpected error occured: {str(e)}")
+        raise InputError(str(e)) from None
+    finally:
+        log_duplicate.flush()
+
+def _log_parse_summary(hits, misses, invalid=0):
+    logging.info("Input file has been parsed")
+    logging.info(f"Duplicate detection: {hits} duplicates skipped, {misses} unique translations")
+    if invalid:
+        logging.warning(f"{invalid} invalid lines skipped")
+
+def peak_rss_mb(children=False):
+    '''
+    The peak resident memory of this process, or of its largest child process.
+
+    Parameters:
+        children -> bool: Measure the terminated child processes instead of this process.
+
+    Returns:
+        float: The peak RSS in MiB, or None on platforms without the resource module.
+    '''
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return round(peak_rss / (1 << 20) if sys.platform == 'darwin' else peak_rss / (1 << 10), 1)
+
+class RunStats:
+    '''
+    Runtime metrics of a run: time spent per stage, lines per second, duplicate, invalid and late line
+    counters, peak window and reorder buffer depths and peak memory usage, with optional periodic progress lines.
+
+    The stages of the pipeline are lazy and each pulls its items from the previous one, so stage() times
+    how long pulling each item takes, which includes the time spent in the previous stages. The time of
+    a stage on its own is then the difference with the previous stage, and whatever time is left, mostly
+    formatting and writing the output, is reported as the 'output' stage.
+
+    Parameters:
+        duplicate_filter -> DuplicateFilter: The duplicate detection of the run, whose counters are reported (optional).
+        decoder -> TranslationDecoder: The decoder of the run, whose counters are reported (optional).
+        reorder_buffer -> ReorderBuffer: The reorder buffer of the run, whose late counter and peak depth are reported (optional).
+        progress_interval -> float: Seconds between progress lines (optional). Defaults to no progress lines.
+
+    Attributes:
+        windows -> SlidingWindows: The windows of the run, whose peak depth is reported, if there are any.
+    '''
+
+    def __init__(self, duplicate_filter=None, decoder=None, progress_interval=None, reorder_buffer=None):
+        self.duplicate_filter = duplicate_filter
+        self.decoder = decoder
+        self.reorder_buffer = reorder_buffer
+        self.progress_interval = progress_interval
+        self.windows = None
+        self.started = time.perf_counter()
+        # Seconds spent pulling the items of each stage and number of items, in pipeline order
+        self._stages = {}
+        self._counters = {}
+
+    def count(self, **counters):
+        '''
+        Add to counters not held by the duplicate filter or decoder, e.g. those of worker processes.
+        '''
+        for name, value in counters.items():
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def stage(self, name, items):
+        '''
+        Time the items pulled from a stage of the pipeline. Stages must be added in pipeline order, the
+        first one reporting progress.
+
+        Returns:
+            iterator: The same items.
+        '''
+        timing = self._stages[name] = [0.0, 0]
+        return self._timed(items, timing, len(self._stages) == 1 and self.progress_interval)
+
+    def _timed(self, items, timing, progress_interval):
+        items = iter(items)
+        next_progress = self.started + progress_interval if progress_interval else math.inf
+
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                timing[0] += time.perf_counter() - started
+                return
+
+            now = time.perf_counter()
+            timing[0] += now - started
+            timing[1] += 1
+            if now >= next_progress:
+                self._log_progress(now)
+                next_progress = now + progress_interval
+            yield item
+
+    def _log_progress(self, now):
+        elapsed = now - self.started
+        lines = self.counters()['lines']
+        message = f"Progress: {lines} lines read in {elapsed:.1f}s ({lines / elapsed:.0f} lines/s)"
+        peak_rss = peak_rss_mb()
+        if peak_rss is not None:
+            message += f", peak RSS {peak_rss} MiB"
+        logging.info(message)
+
+    def counters(self):
+        '''
+        The lines read so far, along with the unique translations, duplicates, invalid lines and late
+        translations among them, and the lines decoded by the fast path of the decoder and the lines it
+        fell back on.
+        '''
+        counters = dict.fromkeys(('translations', 'duplicates', 'invalid'), 0)
+        if self.duplicate_filter is not None:
+            counters['translations'] = self.duplicate_filter.misses
+            counters['duplicates'] = self.duplicate_filter.hits
+        if self.decoder is not None:
+            counters['invalid'] = self.decoder.invalid
+            if self.decoder.mode == 'fast':
+                counters['fast_decoded'] = self.decoder.fast_decoded
+                counters['fallbacks'] = self.decoder.fallbacks
+        if self.reorder_buffer is not None:
+            counters['late'] = self.reorder_buffer.late
+        for name, value in self._counters.items():
+            counters[name] = counters.get(name, 0) + value
+
+        counters['lines'] = counters['translations'] + counters['duplicates'] + counters['invalid'] + counters.get('late', 0)
+        return counters
+
+    def summary(self):
+        '''
+        Returns:
+            dict: The metrics of the run so far, which can be serialized as JSON.
+        '''
+        seconds = time.perf_counter() - self.started
+        counters = self.counters()
+
+        stages = {}
+        previous = 0.0
+        for name, (stage_seconds, items) in self._stages.items():
+            stages[name] = {'seconds': round(stage_seconds - previous, 4), 'items': items}
+            previous = stage_seconds
+        stages['output'] = {'seconds': round(seconds - previous, 4)}
+
+        summary = {
+            'seconds': round(seconds, 4),
+            'lines_per_second': round(counters['lines'] / seconds) if seconds else None,
+            **counters,
+            'stages': stages,
+            'peak_window_depth': self.windows.peak_depth if self.windows is not None else None,
+            'peak_reorder_depth': self.reorder_buffer.peak_depth if self.reorder_buffer is not None else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_children_rss_mb': peak_rss_mb(children=True),
+        }
+        return summary
+
+def read_translations(file_path, duplicate_filter=None):
+    '''
+    Lazily parse the input JSON file, yielding one validated event dictionary at a time.
+
+    Only the duplicate detection state is kept in memory, so the whole file never has
+    to be loaded at once.
+
+    Parameters:
+        file_path -> str: The path to the input file, or a list of paths to files each sorted by timestamp, merged into a single sorted stream. Compressed files are decompressed as in open_input().
+        duplicate_filter -> DuplicateFilter: Detects repeated translations (optional). Defaults to remembering every id.
+
+    Yields:
+        translation -> dict: A dictionary representing an event, with its timestamp converted to a datetime.
+
+    Raises:
+        InputError: If the file cannot be read or one of its translations is invalid.
+    '''
+
+    if duplicate_filter is None:
+        duplicate_filter = DuplicateFilter()
+
+    for translation, timestamp in _read_translations(file_path, duplicate_filter):
+        translation['timestamp'] = EPOCH + timedelta(microseconds=timestamp)
+        yield translation
+
+    _log_parse_summary(duplicate_filter.hits, duplicate_filter.misses)
+
+def read_events(file_path, duplicate_filter=None, group_by=None, lines=None, decoder=None, reorder_buffer=None):
+    '''
+    Lazily parse the input JSON file, yielding only what the moving average needs from each translation.
+
+    Parameters:
+        file_path -> str: The path to the input file, or a list of paths to files each sorted by timestamp, merged into a single sorted stream. Compressed files are decompressed as in open_input().
+        duplicate_filter -> DuplicateFilter: Detects repeated translations (optional). Defaults to remembering every id.
+        group_by -> list: Fields of GROUP_FIELDS to group the translations by (optional).
+        lines -> iterable: Lines to parse instead of reading the file, e.g. from follow_lines() (optional).
+        decoder -> TranslationDecoder: Decodes the lines (optional). It must extract the group_by fields.
+        reorder_buffer -> ReorderBuffer: Sorts translations read slightly out of order and drops the late ones (optional).
+                                         Defaults to expecting the input sorted by timestamp.
+
+    Yields:
+        event -> tuple: The timestamp in microseconds since EPOCH and the duration of a translation, followed by
+                        the tuple of its group_by values if group_by is given.
+
+    Raises:
+        InputError: If the file cannot be read or one of its translations is invalid.
+    '''
+
+    if duplicate_filter is None:
+        duplicate_filter = DuplicateFilter()
+
+    if decoder is None:
+        decoder = TranslationDecoder(fields=group_by or ())
+
+    translations = _read_translations(file_path, duplicate_filter, lines=lines, decoder=decoder, reorder_buffer=reorder_buffer)
+    if group_by:
+        for translation, timestamp in translations:
+            yield timestamp, translation['duration'], tuple(translation[field] for field in group_by)
+    else:
+        for translation, timestamp in translations:
+            yield timestamp, translation['duration']
+
+    _log_parse_summary(duplicate_filter.hits, duplicate_filter.misses, decoder.invalid)
+    if reorder_buffer is not None and reorder_buffer.late:
+        logging.warning(f"{reorder_buffer.late} late translations dropped")
+
+def split_file(file_path, parts):
+    '''
+    Split a file into at most parts byte ranges of similar size, each starting at the start of a line.
+
+    Parameters:
+        file_path -> str: The path to the file.
+        parts -> int: The number of ranges wanted.
+
+    Returns:
+        chunks -> list: (start, end) byte offsets of each range.
+    '''
+    size = os.path.getsize(file_path)
+    offsets = [0]
+
+    with open(file_path, 'rb') as input_file:
+        for part in range(1, parts):
+            # Move forward to the start of the next line
+            input_file.seek(max(size * part // parts - 1, offsets[-1]))
+            input_file.readline()
+            if offsets[-1] < input_file.tell() < size:
+                offsets.append(input_file.tell())
+
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+def _line_timestamp(line):
+    '''
+    Timestamp of a raw input line, or None if it cannot be parsed.
+    '''
+    try:
+        return parse_timestamp(json.loads(line)['timestamp'])
+    except Exception:
+        return None
+
+def _first_line_timestamp(input_file, end):
+    '''
+    Timestamp of the first line from the current position of input_file that can be decoded, skipping
+    unreadable lines, or None if no such line starts before end.
+    '''
+    position = input_file.tell()
+    while position < end:
+        line = input_file.readline()
+        if not line:
+            return None
+        line_timestamp = _line_timestamp(line)
+        if line_timestamp is not None:
+            return line_timestamp
+        position += len(line)
+    return None
+
+def _find_line_offset(input_file, timestamp, low, high):
+    '''
+    Binary search a sorted file for the first line starting in [low, high) whose timestamp is at or
+    after timestamp, returning high if there is none. Unreadable lines are skipped, since invalid lines
+    may be anywhere in the file: each probe uses the first readable line from where it lands.
+    '''
+    end = high
+
+    def line_at(offset):
+        # The start of the first line starting at or after offset, and the first readable timestamp from there
+        input_file.seek(offset - 1 if offset else 0)
+        if offset:
+            input_file.readline()
+        line_start = input_file.tell()
+        return line_start, _first_line_timestamp(input_file, end)
+
+    while low < high:
+        middle = (low + high) // 2
+        line_timestamp = line_at(middle)[1]
+        if line_timestamp is None or line_timestamp >= timestamp:
+            high = middle
+        else:
+            low = middle + 1
+
+    return min(line_at(low)[0], end)
+
+def _seed_duplicate_filter(file_path, duplicate_filter, start, decoder_options):
+    '''
+    Replay into duplicate_filter the translation ids that precede byte offset start by at most
+    its horizon, so that a chunk makes the same decisions as a single process would, also for
+    duplicates of translations from earlier chunks.
+    '''
+    with open(file_path, 'rb') as input_file:
+        # Invalid lines are skipped or reported by the chunk they belong to, so the horizon starts from the first readable one
+        input_file.seek(start)
+        first_timestamp = _first_line_timestamp(input_file, os.fstat(input_file.fileno()).st_size)
+        if first_timestamp is None:
+            return
+
+        first_minute = first_timestamp // MICROSECONDS_PER_MINUTE
+        lead_in = _find_line_offset(input_file, duplicate_filter.replay_start(first_minute) * MICROSECONDS_PER_MINUTE, 0, start)
+
+        # Invalid lines are reported by the chunk they belong to
+        decoder = TranslationDecoder(decoder_options['mode'], 'skip')
+        for line in _read_lines(input_file, lead_in, start):
+            decoded = decoder.decode(line)
+            if decoded is not None:
+                translation, timestamp = decoded
+                duplicate_filter.is_duplicate(translation['translation_id'], timestamp // MICROSECONDS_PER_MINUTE)
+
+    duplicate_filter.hits = duplicate_filter.misses = 0
+
+def _aggregate_chunk(file_path, duplicate_filter_options, decoder_options, chunk):
+    '''
+    Worker process: aggregate the translations of one chunk of the input file per minute.
+
+    Returns:
+        tuple: The list of minute buckets of the chunk, its duplicate hit and miss counters and its number of invalid lines skipped.
+    '''
+    start, end = chunk
+    duplicate_filter = DuplicateFilter(**duplicate_filter_options)
+    decoder = TranslationDecoder(**decoder_options)
+    if start:
+        _seed_duplicate_filter(file_path, duplicate_filter, start, decoder_options)
+
+    events = ((timestamp, translation['duration']) for translation, timestamp in _read_translations(file_path, duplicate_filter, start, end, decoder=decoder))
+    buckets = list(aggregate_minutes(events))
+    return buckets, duplicate_filter.hits, duplicate_filter.misses, decoder.invalid
+
+def read_buckets_parallel(file_path, workers, duplicate_filter_options, decoder_options=None, stats=None):
+    '''
+    Aggregate the input file per minute using several processes.
+
+    The file is split into newline aligned byte ranges, each parsed by its own process into per minute
+    (sum, count) aggregates, which are merged here in order. Each process first replays the translation
+    ids from the duplicate detection horizon preceding its range, so duplicates are detected exactly as
+    a single process would, also across ranges.
+
+    Parameters:
+        file_path -> str: The path to the input file.
+        workers -> int: The number of processes to use.
+        duplicate_filter_options -> dict: Keyword arguments of the DuplicateFilter of each process. A horizon is required.
+        decoder_options -> dict: Keyword arguments of the TranslationDecoder of each process (optional).
+        stats -> RunStats: Records the counters of the processes as their chunks are merged (optional).
+
+    Yields:
+        bucket -> tuple: The aggregates of each minute with translations, as produced by aggregate_minutes().
+
+    Raises:
+        InputError: If the file cannot be read or one of its translations is invalid.
+    '''
+    try:
+        chunks = split_file(file_path, workers)
+    except FileNotFoundError:
+        logging.error(f"File {file_path} not found.")
+        raise InputError(f"File {file_path} not found") from None
+
+    if decoder_options is None:
+        decoder_options = {'mode': 'json', 'on_invalid': 'abort'}
+
+    hits = misses = invalid = 0
+    pending = None
+
+    with Pool(min(workers, len(chunks))) as pool:
+        for buckets, chunk_hits, chunk_misses, chunk_invalid in pool.imap(partial(_aggregate_chunk, file_path, duplicate_filter_options, decoder_options), chunks):
+            hits += chunk_hits
+            misses += chunk_misses
+            invalid += chunk_invalid
+            if stats is not None:
+                stats.count(translations=chunk_misses, duplicates=chunk_hits, invalid=chunk_invalid)
+            if not buckets:
+                continue
+
+            # Consecutive chunks may share the minute in which the file was split
+            if pending is not None and pending[0] == buckets[0][0]:
+                buckets[0] = (pending[0],) + tuple(a + b for a, b in zip(pending[1:], buckets[0][1:]))
+            elif pending is not None:
+                yield pending
+
+            yield from buckets[:-1]
+            pending = buckets[-1]
+
+    if pending is not None:
+        yield pending
+
+    _log_parse_summary(hits, misses, invalid)
+
+def parse_input(file_path, duplicate_filter=None):
+    '''
+    Parse the input JSON file and convert it into a list of event dictionaries.
+    
+    Parameters:
+        file_path -> str: The path to the input file, or a list of paths to files each sorted by timestamp, merged into a single sorted stream. Compressed files are decompressed as in open_input().
+        duplicate_filter -> DuplicateFilter: Detects repeated translations (optional).
+        
+    Returns:
+        translations -> list: A list of dictionaries, each representing an event.
+    '''
+
+    try:
+        return deque(read_translations(file_path, duplicate_filter))
+    except InputError:
+        return None
+
+
+def _moving_average_record(minute, average):
+    '''
+    Build the output record of a minute.
+    '''
+    return {
+        "date": format_minute(minute),
+        "average_delivery_time": f'{average:g}'
+    }
+
+def stream_window_averages(events, window_size):
+    '''
+    Lazily calculate the moving average of translation delivery times per minute for a specified window size.
+
+    A minute is yielded as soon as an event at or after it is read, since the input is
+    sorted by timestamp and no later event can change its average anymore. Only the
+    events inside the current window are kept in memory.
+
+    Parameters:
+        events -> iterable: (timestamp, duration) tuples sorted by timestamp, in microseconds since EPOCH.
+        window_size -> int: The size of the window for which the moving average is to be calculated.
+
+    Yields:
+        tuple: A minute, counted from EPOCH, and a list holding its moving average.
+    '''
+
+    window_queue = deque()
+    window_sum = 0
+    window_span = window_size * MICROSECONDS_PER_MINUTE
+    current_minute = None
+    last_timestamp = None
+
+    def window_average():
+        nonlocal window_sum
+
+        # Remove events from the window that are older than the current minute minus the window_size
+        window_start = current_minute * MICROSECONDS_PER_MINUTE - window_span
+        while window_queue and window_queue[0][0] <= window_start:
+            window_sum -= window_queue.popleft()[1]
+
+        average = window_sum / len(window_queue) if window_queue else 0
+        return current_minute, [average]
+
+    for event in events:
+        last_timestamp = event[0]
+        if current_minute is None:
+            current_minute = last_timestamp // MICROSECONDS_PER_MINUTE
+
+        # Every minute up to this event's timestamp only depends on the events already read
+        while current_minute * MICROSECONDS_PER_MINUTE <= last_timestamp:
+            yield window_average()
+            current_minute += 1
+
+        window_sum += event[1]
+        window_queue.append(event)
+
+    if last_timestamp is None:
+        return
+
+    # Flush the remaining minutes, up to the minute after the last event
+    last_minute = last_timestamp // MICROSECONDS_PER_MINUTE + 1
+    while current_minute <= last_minute:
+        yield window_average()
+        current_minute += 1
+
+def stream_moving_average(events, window_size):
+    '''
+    Lazily calculate the moving average of translation delivery times per minute for a specified window size,
+    yielding each minute as soon as it closes, as stream_window_averages() does.
+
+    Parameters:
+        events -> iterable: (timestamp, duration) tuples sorted by timestamp, in microseconds since EPOCH.
+        window_size -> int: The size of the window for which the moving average is to be calculated.
+
+    Yields:
+        moving_average -> dict: A dictionary containing a minute and the corresponding moving average.
+    '''
+    for minute, (average,) in stream_window_averages(events, window_size):
+        yield _moving_average_record(minute, average)
+
+def _add_to_bucket(bucket, offset, duration):
+    # Add an event to its minute's bucket, as aggregated by aggregate_minutes(), given its offset in the minute
+    if offset:
+        bucket[1] += duration
+        bucket[2] += 1
+    else:
+        bucket[3] += duration
+        bucket[4] += 1
+
+def aggregate_minutes(events):
+    '''
+    Lazily aggregate events per minute.
+
+    Events falling exactly on a minute boundary leave the window one minute earlier than the others
+    (the window start is excluded), so they are aggregated separately.
+
+    Parameters:
+        events -> iterable: (timestamp, duration) tuples sorted by timestamp, in microseconds since EPOCH.
+
+    Yields:
+        bucket -> tuple: (minute, sum, count, boundary_sum, boundary_count) for each minute with events,
+                         where the boundary aggregates only cover the events exactly on the minute.
+    '''
+    bucket = None
+
+    for timestamp, duration in events:
+        minute, offset = divmod(timestamp, MICROSECONDS_PER_MINUTE)
+        if bucket is None or bucket[0] != minute:
+            if bucket is not None:
+                yield tuple(bucket)
+            bucket = [minute, 0, 0, 0, 0]
+
+        _add_to_bucket(bucket, offset, duration)
+
+    if bucket is not None:
+        yield tuple(bucket)
+
+class SlidingWindows:
+    '''
+    Incremental moving averages per minute for several window sizes over per minute aggregates.
+
+    Running totals of the buckets are only kept as far back as the longest window, and the total of
+    each window is the difference between the running totals at its end and just before its start.
+    The output for each window matches stream_moving_average() on the events the buckets were
+    aggregated from.
+
+    Parameters:
+        window_sizes -> list: The sizes of the windows for which the moving averages are to be calculated.
+        current_minute -> int: The next minute to output, when restoring a saved state (optional).
+        buckets -> iterable: The buckets still inside the windows, when restoring a saved state (optional).
+
+    Attributes:
+        peak_depth -> int: The largest number of buckets inside the longest window so far.
+    '''
+
+    def __init__(self, window_sizes, current_minute=None, buckets=()):
+        self.window_sizes = window_sizes
+        self.current_minute = current_minute
+        self.peak_depth = 0
+
+        # Running (sum, count, boundary_sum, boundary_count) totals up to and including each bucket's minute,
+        # starting with the totals before any bucket
+        self._totals = [(-math.inf, 0, 0, 0, 0)]
+        # For each window, the index in totals of the last bucket before its start, for regular events
+        # and for events exactly on a minute boundary, which leave the window one minute earlier
+        self._starts = [0] * len(window_sizes)
+        self._boundary_starts = [0] * len(window_sizes)
+
+        for bucket in buckets:
+            self._append(bucket)
+
+    def add(self, bucket):
+        '''
+        Add the next bucket, yielding the minutes it closes. Must be exhausted before adding another bucket.
+
+        Parameters:
+            bucket -> tuple: The next bucket, as produced by aggregate_minutes().
+
+        Yields:
+            tuple: A minute, counted from EPOCH, and the list of its moving averages, one per window size.
+        '''
+        for start, end, averages in self.add_runs(bucket):
+            for minute in range(start, end):
+                yield minute, averages
+
+    def add_runs(self, bucket):
+        '''
+        Add the next bucket, yielding the minutes it closes as runs of consecutive minutes with the same
+        moving averages. Between buckets the averages only change when a bucket leaves a window, so the
+        cost depends on the number of buckets rather than on the number of minutes they are apart.
+        Must be exhausted before adding another bucket.
+
+        Parameters:
+            bucket -> tuple: The next bucket, as produced by aggregate_minutes().
+
+        Yields:
+            tuple: The first minute of a run, counted from EPOCH, the minute after its last one and the list
+                   of their moving averages, one per window size.
+        '''
+        minute = bucket[0]
+        if self.current_minute is None:
+            self.current_minute = minute
+
+        # A minute only depends on the buckets before it
+        while self.current_minute <= minute:
+            averages = self._averages()
+            end = min(minute + 1, self._next_change())
+            yield self.current_minute, end, averages
+            self.current_minute = end
+
+        self._append(bucket)
+
+    def finish(self):
+        '''
+        Yield the minute after the last bucket, which ends the output.
+        '''
+        if self.current_minute is not None:
+            yield self.current_minute, self._averages()
+
+    def buckets(self):
+        '''
+        The buckets some window may still need, from which the state can be restored.
+        '''
+        oldest = min(self._starts + self._boundary_starts)
+        buckets = []
+        for previous, totals in zip(self._totals[oldest:], self._totals[oldest + 1:]):
+            buckets.append((totals[0],) + tuple(total - previous_total for total, previous_total in zip(totals[1:], previous[1:])))
+        return buckets
+
+    def _append(self, bucket):
+        minute, bucket_sum, bucket_count, boundary_sum, boundary_count = bucket
+        _, window_sum, window_count, window_boundary_sum, window_boundary_count = self._totals[-1]
+        self._totals.append((minute, window_sum + bucket_sum, window_count + bucket_count,
+                             window_boundary_sum + boundary_sum, window_boundary_count + boundary_count))
+
+    def _last_before(self, index, minute):
+        # Move an index forward to the last bucket at or before minute
+        totals = self._totals
+        while index + 1 < len(totals) and totals[index + 1][0] <= minute:
+            index += 1
+        return index
+
+    def _next_change(self):
+        # The first minute after the current one at which a bucket leaves some window
+        totals = self._totals
+        change = math.inf
+        for i, window_size in enumerate(self.window_sizes):
+            if self._starts[i] + 1 < len(totals):
+                change = min(change, totals[self._starts[i] + 1][0] + window_size + 1)
+            if self._boundary_starts[i] + 1 < len(totals):
+                change = min(change, totals[self._boundary_starts[i] + 1][0] + window_size)
+        return change
+
+    def _averages(self):
+        totals, starts, boundary_starts = self._totals, self._starts, self._boundary_starts
+        _, window_sum, window_count, boundary_sum, boundary_count = totals[-1]
+        result = []
+
+        for i, window_size in enumerate(self.window_sizes):
+            starts[i] = self._last_before(starts[i], self.current_minute - window_size - 1)
+            boundary_starts[i] = self._last_before(boundary_starts[i], self.current_minute - window_size)
+            start, boundary_start = totals[starts[i]], totals[boundary_starts[i]]
+
+            total = window_sum - start[1] + boundary_sum - boundary_start[3]
+            count = window_count - start[2] + boundary_count - boundary_start[4]
+            result.append(total / count if count else 0)
+
+        # Forget the totals no window can reach anymore
+        oldest = min(starts)
+        self.peak_depth = max(self.peak_depth, len(totals) - 1 - oldest)
+        if oldest > 1024 and oldest * 2 > len(totals):
+            del totals[:oldest]
+            for i in range(len(starts)):
+                starts[i] -= oldest
+                boundary_starts[i] -= oldest
+
+        return result
+
+def window_average_runs(buckets, window_sizes, windows=None):
+    '''
+    Lazily calculate the moving averages for several window sizes in a single pass over per minute
+    aggregates, with SlidingWindows, as runs of consecutive minutes with the same averages, so that
+    gaps between translations cost nothing per minute.
+
+    Parameters:
+        buckets -> iterable: Buckets sorted by minute, as produced by aggregate_minutes().
+        window_sizes -> list: The sizes of the windows for which the moving averages are to be calculated.
+        windows -> SlidingWindows: The windows to calculate them with (optional), e.g. to inspect them afterwards.
+
+    Yields:
+        tuple: The first minute of a run, counted from EPOCH, the minute after its last one and the list of
+               their moving averages, one per window size.
+    '''
+    if windows is None:
+        windows = SlidingWindows(window_sizes)
+    for bucket in buckets:
+        yield from windows.add_runs(bucket)
+    for minute, averages in windows.finish():
+        yield minute, minute + 1, averages
+
+def minute_runs(minute_averages):
+    '''
+    Group the consecutive minutes with the same moving averages, e.g. from numpy_window_averages(),
+    into runs as produced by window_average_runs().
+    '''
+    run = None
+    for minute, averages in minute_averages:
+        if run is not None and run[1] == minute and run[2] == averages:
+            run[1] += 1
+            continue
+        if run is not None:
+            yield tuple(run)
+        run = [minute, minute + 1, averages]
+
+    if run is not None:
+        yield tuple(run)
+
+def clip_runs(runs, first_minute, last_minute):
+    '''
+    Lazily cut runs of minutes, as produced by window_average_runs(), down to the minutes from first_minute
+    to last_minute included.
+    '''
+    for start, end, averages in runs:
+        start, end = max(start, first_minute), min(end, last_minute + 1)
+        if start < end:
+            yield start, end, averages
+
+def python_average_runs(events, window_sizes, windows=None):
+    '''
+    Calculate the moving averages for several window sizes, aggregating the events per minute as they are read.
+
+    Parameters:
+        events -> iterable: (timestamp, duration) tuples sorted by timestamp, in microseconds since EPOCH.
+        window_sizes -> list: The sizes of the windows for which the moving averages are to be calculated.
+        windows -> SlidingWindows: The windows to calculate them with (optional), e.g. to inspect them afterwards.
+
+    Returns:
+        runs -> iterable: Runs of minutes and their moving averages, as produced by window_average_runs().
+    '''
+    return window_average_runs(aggregate_minutes(events), window_sizes, windows)
+
+def numpy_window_averages(events, window_sizes):
+    '''
+    Calculate the same moving averages as python_average_runs(), one minute at a time, with vectorized NumPy operations.
+
+    All events are loaded into arrays, which trades the bounded memory of the streaming engine
+    for speed. Durations are summed per minute with bincount and the totals of each window are
+    differences of cumulative sums. Events falling exactly on a minute boundary leave the window
+    one minute earlier than the others (the window start is excluded), so they are summed separately.
+
+    Parameters:
+        events -> iterable: (timestamp, duration) tuples sorted by timestamp, in microseconds since EPOCH.
+        window_sizes -> list: The sizes of the windows for which the moving averages are to be calculated.
+
+    Yields:
+        tuple: A minute, counted from EPOCH, and the list of its moving averages, one per window size.
+    '''
+
+    timestamps = array('q')
+    durations = array('q')
+    for timestamp, duration in events:
+        timestamps.append(timestamp)
+        durations.append(duration)
+    if not timestamps:
+        return
+
+    timestamps = np.frombuffer(timestamps, dtype=np.int64)
+    durations = np.frombuffer(durations, dtype=np.int64)
+
+    first_minute = timestamps[0] // MICROSECONDS_PER_MINUTE
+    minute_count = int(timestamps[-1] // MICROSECONDS_PER_MINUTE - first_minute) + 2
+    indexes = timestamps // MICROSECONDS_PER_MINUTE - first_minute
+    on_boundary = timestamps % MICROSECONDS_PER_MINUTE == 0
+    minutes = np.arange(minute_count)
+
+    def cumulative(mask):
+        # Totals of the minutes before each minute
+        sums = np.bincount(indexes[mask], weights=durations[mask], minlength=minute_count)[:minute_count]
+        counts = np.bincount(indexes[mask], minlength=minute_count)[:minute_count]
+        return (np.concatenate(([0], np.cumsum(np.rint(sums).astype(np.int64)))),
+                np.concatenate(([0], np.cumsum(counts))))
+
+    def window_totals(totals, window_start):
+        # Totals of the minutes in [minute - window_start, minute - 1] for each minute
+        return totals[:minute_count] - totals[np.maximum(minutes - window_start, 0)]
+
+    # Events before the first one can only come from unsorted input and cannot be placed
+    in_range = indexes >= 0
+    sums, counts = cumulative(in_range & ~on_boundary)
+    boundary_sums, boundary_counts = cumulative(in_range & on_boundary)
+
+    columns = []
+    for window_size in window_sizes:
+        window_sums = window_totals(sums, window_size) + window_totals(boundary_sums, window_size - 1)
+        window_counts = window_totals(counts, window_size) + window_totals(boundary_counts, window_size - 1)
+        columns.append(np.divide(window_sums, window_counts, out=np.zeros(minute_count), where=window_counts > 0).tolist())
+
+    first_minute = int(first_minute)
+    for index, averages in enumerate(zip(*columns)):
+        yield first_minute + index, list(averages)
+
+def numpy_average_runs(events, window_sizes, windows=None):
+    '''
+    Calculate the moving averages of numpy_window_averages() as runs of minutes, as python_average_runs() does.
+    The windows are accepted for a common signature but left unused, since no window slides here.
+    '''
+    return minute_runs(numpy_window_averages(events, window_sizes))
+
+# Moving average engines selectable from the CLI, each calculating runs of minutes from sorted events
+ENGINES = {
+    'python': python_average_runs,
+    'numpy': numpy_average_runs,
+}
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch with relative error guarantees, after DDSketch.
+
+    Durations are counted in logarithmic buckets, bucket i holding the values in (gamma^(i-1), gamma^i]
+    with gamma = (1 + relative_accuracy) / (1 - relative_accuracy). Negative durations, which the moving
+    averages take as they are, are counted in a mirrored set of buckets by their absolute value, and
+    zero durations are counted apart. Any quantile is then estimated within relative_accuracy of an
+    actual duration of that rank, so percentiles stay consistent with the average of the same window.
+    Since durations are integers, each set has at most log(max |duration|) / log(gamma) + 1 buckets,
+    e.g. about 1075 for durations under 2^31 with the default 1% accuracy, however many are added.
+
+    Sketches with the same accuracy are merged and subtracted by adding and subtracting their bucket
+    counts, which is what lets a window sketch be updated as minutes enter and leave it.
+    '''
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.counts = {}
+        self.negative_counts = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        if value:
+            counts = self.counts if value > 0 else self.negative_counts
+            key = math.ceil(math.log(abs(value)) / self._log_gamma)
+            counts[key] = counts.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+
+    def merge(self, other, sign=1):
+        '''
+        Add the counts of another sketch with the same accuracy, or subtract them if sign is -1.
+        '''
+        for counts, other_counts in ((self.counts, other.counts), (self.negative_counts, other.negative_counts)):
+            for key, count in other_counts.items():
+                count = counts.get(key, 0) + sign * count
+                if count:
+                    counts[key] = count
+                else:
+                    # Forget empty buckets, so memory follows the contents of the sketch
+                    del counts[key]
+        self.zero_count += sign * other.zero_count
+        self.count += sign * other.count
+
+    def quantile(self, q):
+        '''
+        Estimate the q-quantile (0 <= q <= 1) of the durations in the sketch, or 0 if it is empty.
+        '''
+        if not self.count:
+            return 0
+
+        rank = q * (self.count - 1)
+        seen = 0
+        # Negative durations first, from the largest absolute value down
+        for key in sorted(self.negative_counts, reverse=True):
+            seen += self.negative_counts[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen > rank:
+                return self._bucket_value(key)
+
+    def _bucket_value(self, key):
+        # The value with the lowest relative error to every value of the bucket
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+def sketch_minutes(events, relative_accuracy=0.01):
+    '''
+    Lazily aggregate events per minute along with quantile sketches of their durations.
+
+    Parameters:
+        events -> iterable: (timestamp, duration) tuples sorted by timestamp, in microseconds since EPOCH.
+        relative_accuracy -> float: The relative accuracy of the sketches (optional).
+
+    Yields:
+        tuple: A bucket as produced by aggregate_minutes(), followed by the sketches of the durations
+               of the minute's events off and exactly on the minute boundary.
+    '''
+    bucket = None
+
+    for timestamp, duration in events:
+        minute, offset = divmod(timestamp, MICROSECONDS_PER_MINUTE)
+        if bucket is None or bucket[0] != minute:
+            if bucket is not None:
+                yield tuple(bucket), sketch, boundary_sketch
+            bucket = [minute, 0, 0, 0, 0]
+            sketch = QuantileSketch(relative_accuracy)
+            boundary_sketch = QuantileSketch(relative_accuracy)
+
+        _add_to_bucket(bucket, offset, duration)
+        (sketch if offset else boundary_sketch).add(duration)
+
+    if bucket is not None:
+        yield tuple(bucket), sketch, boundary_sketch
+
+def percentile_window_averages(events, window_size, percentiles, relative_accuracy=0.01, windows=None):
+    '''
+    Lazily calculate the moving average per minute along with percentiles of the delivery times
+    in the same window.
+
+    The window sketch is the sum of the sketches of the minutes inside the window: each minute's
+    sketches are merged into it when the minute enters the window and subtracted when it leaves, so
+    a minute costs time proportional to the buckets of the sketches involved rather than to events.
+
+    Parameters:
+        events -> iterable: (timestamp, duration) tuples sorted by timestamp, in microseconds since EPOCH.
+        window_size -> int: The size of the window for which the moving average is to be calculated.
+        percentiles -> list: The percentiles to estimate, between 0 and 100.
+        relative_accuracy -> float: The relative accuracy of the percentiles (optional).
+        windows -> SlidingWindows: The window to calculate the moving average with (optional), e.g. to inspect it afterwards.
+
+    Yields:
+        tuple: A minute, counted from EPOCH, a list with its moving average and the list of its percentiles.
+    '''
+    if windows is None:
+        windows = SlidingWindows([window_size])
+    window_sketch = QuantileSketch(relative_accuracy)
+    # Sketches inside the window, oldest first: (minute, sketch, boundary_sketch)
+    sketches = deque()
+    quantiles = [percentile / 100 for percentile in percentiles]
+
+    def expire(minute):
+        # Regular events leave the window window_size minutes after theirs, boundary events one minute earlier
+        while sketches and sketches[0][0] <= minute - window_size:
+            expired_minute, sketch, boundary_sketch = sketches[0]
+            if boundary_sketch is not None:
+                window_sketch.merge(boundary_sketch, -1)
+                sketches[0] = (expired_minute, sketch, None)
+            if expired_minute < minute - window_size:
+                window_sketch.merge(sketch, -1)
+                sketches.popleft()
+            else:
+                break
+
+    def with_percentiles(minute_averages):
+        for minute, averages in minute_averages:
+            expire(minute)
+            yield minute, averages, [window_sketch.quantile(q) for q in quantiles]
+
+    for bucket, sketch, boundary_sketch in sketch_minutes(events, relative_accuracy):
+        yield from with_percentiles(windows.add(bucket))
+        window_sketch.merge(sketch)
+        window_sketch.merge(boundary_sketch)
+        sketches.append((bucket[0], sketch, boundary_sketch))
+
+    yield from with_percentiles(windows.finish())
+
+def format_percentile_averages(minute_averages, percentiles):
+    '''
+    Lazily turn moving averages and percentiles into output records, with a "p<percentile>_delivery_time"
+    key per percentile, e.g. "p95_delivery_time".
+
+    Parameters:
+        minute_averages -> iterable: Minutes, moving averages and percentiles, as produced by percentile_window_averages().
+        percentiles -> list: The percentiles that were estimated.
+
+    Yields:
+        records -> tuple: The single record of each minute.
+    '''
+    keys = [f'p{percentile:g}_delivery_time' for percentile in percentiles]
+    for minute, (average,), values in minute_averages:
+        record = _moving_average_record(minute, average)
+        record.update((key, f'{value:g}') for key, value in zip(keys, values))
+        yield (record,)
+
+def _minute_lines(start, end, before, after):
+    # The output lines of the minutes in [start, end), each being before, the date and after, an hour at a time
+    blocks = []
+    while start < end:
+        hour, first = divmod(start, 60)
+        last = min(60, first + end - start)
+        head = f'{before}{_format_hour(hour)}'
+        blocks.append(head + (after + head).join(_MINUTE_SUFFIXES[first:last]) + after)
+        start += last - first
+    return ''.join(blocks)
+
+# Formats of the moving averages, as written by format_average_runs()
+OUTPUT_FORMATS = ('json', 'runs', 'csv', 'binary')
+
+# Header of the binary output format, followed by the number of average columns as a uint32
+BINARY_OUTPUT_MAGIC = b'UBAVGCOL'
+
+# Rows per block of the binary output format
+BINARY_BLOCK_ROWS = 4096
+
+def format_average_runs(runs, window_sizes, combine=False, output_format='json'):
+    '''
+    Lazily render runs of minutes with the same moving averages into blocks of output.
+
+    The lines of a run are rendered from templates, joining precomputed date strings around averages
+    formatted once, so long runs cost no per-minute Python work. The formats are:
+
+        - json: One JSON line per minute, e.g. {"date": "2018-12-26 18:16:00", "average_delivery_time": "25.5"}, with an
+          "average_delivery_time_<window size>" key per window instead when the windows are combined.
+        - runs: One JSON line per run of consecutive minutes with the same average, holding its first
+          and last dates, e.g. {"from": "2018-12-26 18:16:00", "to": "2018-12-26 18:21:00", "average_delivery_time": "25.5"}.
+        - csv: A header, then one "date,average" row per minute.
+        - binary: Columnar blocks for loaders such as NumPy. After BINARY_OUTPUT_MAGIC and the number of
+          average columns (uint32), each block holds its number of rows (uint32), the minutes as Unix
+          timestamps (int64) and then each column of averages (float64). Integers and floats are little endian.
+
+    Parameters:
+        runs -> iterable: Runs of minutes and their moving averages, as produced by window_average_runs().
+        window_sizes -> list: The sizes of the windows the moving averages were calculated for.
+        combine -> bool: Whether all windows go into a single output file, with a key per window (optional).
+        output_format -> str: One of OUTPUT_FORMATS (optional).
+
+    Yields:
+        blocks -> tuple: The text, or bytes in the binary format, to append to each output file.
+    '''
+    combined = combine and len(window_sizes) > 1
+    keys = [f'average_delivery_time_{window_size}' for window_size in window_sizes] if combined else ['average_delivery_time']
+    file_count = 1 if combined else len(window_sizes)
+
+    def columns(averages):
+        # The averages of each output file
+        return (averages,) if combined else tuple((average,) for average in averages)
+
+    if output_format == 'binary':
+        yield from _binary_blocks(runs, columns, file_count, len(keys))
+        return
+
+    if output_format == 'runs':
+        yield from _run_lines(runs, keys, columns)
+        return
+
+    if output_format == 'csv':
+        yield (f'date,{",".join(keys)}\n',) * file_count
+        before = ''
+        template = ''.join(',{}' for key in keys) + '\n'
+    else:
+        before = '{"date": "'
+        template = '", ' + ', '.join(f'"{key}": "{{}}"' for key in keys) + '}}\n'
+
+    for start, end, averages in runs:
+        afters = [template.format(*(f'{average:g}' for average in column)) for column in columns(averages)]
+        # Bound the size of the blocks of long runs
+        for block_start in range(start, end, 1440):
+            block_end = min(end, block_start + 1440)
+            yield tuple(_minute_lines(block_start, block_end, before, after) for after in afters)
+
+def _run_lines(runs, keys, columns):
+    # One line per run of consecutive minutes with the same averages, merged separately for each output
+    # file, as other windows may change in between
+    def run_line(run):
+        start, end, body = run
+        return f'{{"from": "{format_minute(start)}", "to": "{format_minute(end - 1)}", {body}}}\n'
+
+    pending = None
+    for start, end, averages in runs:
+        current = [[start, end, ', '.join(f'"{key}": "{average:g}"' for key, average in zip(keys, column))]
+                   for column in columns(averages)]
+        if pending is None:
+            pending = current
+            continue
+
+        block = []
+        for i, run in enumerate(current):
+            if pending[i][1] == start and pending[i][2] == run[2]:
+                pending[i][1] = end
+                block.append('')
+            else:
+                block.append(run_line(pending[i]))
+                pending[i] = run
+        if any(block):
+            yield tuple(block)
+
+    if pending is not None:
+        yield tuple(run_line(run) for run in pending)
+
+def _binary_blocks(runs, columns, file_count, column_count):
+    # Columnar blocks of up to BINARY_BLOCK_ROWS minutes, built with array operations rather than per minute
+    yield (BINARY_OUTPUT_MAGIC + struct.pack('<I', column_count),) * file_count
+
+    def block(times, columns):
+        return struct.pack('<I', len(times)) + times.tobytes() + b''.join(column.tobytes() for column in columns)
+
+    times = array('q')
+    files = [[array('d') for _ in range(column_count)] for _ in range(file_count)]
+    for start, end, averages in runs:
+        times.extend(range(start * 60, end * 60, 60))
+        for file_columns, file_values in zip(files, columns(averages)):
+            for column, value in zip(file_columns, file_values):
+                column.extend(array('d', [value]) * (end - start))
+
+        if len(times) >= BINARY_BLOCK_ROWS:
+            yield tuple(block(times, file_columns) for file_columns in files)
+            times = array('q')
+            files = [[array('d') for _ in range(column_count)] for _ in range(file_count)]
+
+    if times:
+        yield tuple(block(times, file_columns) for file_columns in files)
+
+def aggregate_group_minutes(events):
+    '''
+    Lazily aggregate grouped events per minute and group.
+
+    Parameters:
+        events -> iterable: (timestamp, duration, group) tuples sorted by timestamp, in microseconds since EPOCH.
+
+    Yields:
+        tuple: A minute with events and a dictionary mapping each of its groups to its
+               [sum, count, boundary_sum, boundary_count] aggregates, as in aggregate_minutes().
+    '''
+    minute = None
+    groups = {}
+
+    for timestamp, duration, group in events:
+        event_minute, offset = divmod(timestamp, MICROSECONDS_PER_MINUTE)
+        if event_minute != minute:
+            if groups:
+                yield minute, groups
+            minute = event_minute
+            groups = {}
+
+        bucket = groups.get(group)
+        if bucket is None:
+            bucket = groups[group] = [0, 0, 0, 0]
+        if offset:
+            bucket[0] += duration
+            bucket[1] += 1
+        else:
+            bucket[2] += duration
+            bucket[3] += 1
+
+    if groups:
+        yield minute, groups
+
+class _GroupWindow:
+    '''
+    Window state of a single group: its buckets inside the window and their running totals.
+    '''
+    __slots__ = ('buckets', 'boundary_buckets', 'total', 'count')
+
+    def __init__(self):
+        self.buckets = deque()
+        self.boundary_buckets = deque()
+        self.total = 0
+        self.count = 0
+
+def grouped_window_averages(group_buckets, window_size):
+    '''
+    Lazily calculate the moving average per minute of every group in a single pass.
+
+    Only groups with translations inside their window are kept, and a group is only visited when
+    one of its buckets enters or leaves the window: each bucket schedules its group for the minute
+    it leaves the window, so groups without recent translations cost nothing per minute.
+
+    Parameters:
+        group_buckets -> iterable: Minutes and their per group aggregates, as produced by aggregate_group_minutes().
+        window_size -> int: The size of the window for which the moving average is to be calculated.
+
+    Yields:
+        tuple: A minute, counted from EPOCH, and the sorted list of (group, moving average) of the groups
+               with translations inside their window. Minutes without any are skipped.
+    '''
+    windows = {}
+    # Groups to update at each minute, because one of their buckets leaves the window then
+    expirations = {}
+    current_minute = None
+
+    def averages():
+        for group in expirations.pop(current_minute, ()):
+            window = windows.get(group)
+            if window is None:
+                continue
+
+            while window.buckets and window.buckets[0][0] < current_minute - window_size:
+                _, bucket_sum, bucket_count = window.buckets.popleft()
+                window.total -= bucket_sum
+                window.count -= bucket_count
+            while window.boundary_buckets and window.boundary_buckets[0][0] <= current_minute - window_size:
+                _, bucket_sum, bucket_count = window.boundary_buckets.popleft()
+                window.total -= bucket_sum
+                window.count -= bucket_count
+
+            if not window.count:
+                del windows[group]
+
+        return [(group, window.total / window.count) for group, window in sorted(windows.items())]
+
+    for minute, groups in group_buckets:
+        if current_minute is None:
+            current_minute = minute
+
+        # A minute only depends on the buckets before it
+        while current_minute <= minute:
+            if not windows:
+                # Every window is empty until this bucket is added, so there is nothing to output
+                expirations.clear()
+                current_minute = minute + 1
+                break
+
+            minute_averages = averages()
+            if minute_averages:
+                yield current_minute, minute_averages
+            current_minute += 1
+
+        for group, (bucket_sum, bucket_count, boundary_sum, boundary_count) in groups.items():
+            window = windows.get(group)
+            if window is None:
+                window = windows[group] = _GroupWindow()
+
+            # Events exactly on the minute boundary leave the window one minute earlier
+            if bucket_count:
+                window.buckets.append((minute, bucket_sum, bucket_count))
+                expirations.setdefault(minute + window_size + 1, []).append(group)
+            if boundary_count:
+                window.boundary_buckets.append((minute, boundary_sum, boundary_count))
+                expirations.setdefault(minute + window_size, []).append(group)
+            window.total += bucket_sum + boundary_sum
+            window.count += bucket_count + boundary_count
+
+    # Flush the minute after the last bucket
+    if windows:
+        minute_averages = averages()
+        if minute_averages:
+            yield current_minute, minute_averages
+
+def format_group_averages(minute_averages, group_by):
+    '''
+    Lazily turn the moving averages of every group into output records, one per group and minute,
+    holding the group_by fields before the average.
+
+    Yields:
+        records -> tuple: A single record, as expected by output_moving_averages().
+    '''
+    for minute, averages in minute_averages:
+        date = format_minute(minute)
+        for group, average in averages:
+            record = {"date": date}
+            record.update(zip(group_by, group))
+            record["average_delivery_time"] = f'{average:g}'
+            yield (record,)
+
+def calculate_moving_average(translations, window_size):
+    '''
+    Calculate the moving average of translation delivery times per minute for a specified window size.
+    
+    Parameters:
+        translations -> deque: A deque of translations, each represented as a dictionary.
+        window_size -> int: The size of the window for which the moving average is to be calculated.
+        
+    Returns:
+        moving_averages -> list: A list of dictionaries, each containing a minute and the corresponding moving average.
+    '''
+
+    events = ((to_timestamp(translation['timestamp']), translation['duration']) for translation in translations)
+    return list(stream_moving_average(events, window_size))
+
+def output_moving_averages(records, output_files, live=False, output_dir='outputs/'):
+    '''
+    Output the calculated moving averages to several files in a single pass, as in output_blocks().
+
+    Parameters:
+        records -> iterable: Tuples with one dictionary per output file, each containing a minute and its moving averages.
+        output_files -> list: The paths to the files where the output should be written, or STDOUT.
+        live -> bool: Whether every record is made visible in the output files as soon as it is written (optional).
+        output_dir -> str: The folder relative output paths are placed in (optional).
+
+    Returns:
+        bool: True if the output was written, False otherwise.
+    '''
+    blocks = (tuple(f'{json.dumps(avg)}\n' for avg in record) for record in records)
+    return output_blocks(blocks, output_files, live, output_dir)
+
+# Output file name that writes to the standard output instead
+STDOUT = '-'
+
+# Buffer size of the output files, so that many small blocks are written in a few system calls
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+def output_path(output_file, output_dir='outputs/'):
     '''
-    Parse the input JSON file and convert it into a list of event dictionaries.
-    
+    The path an output file is written to: relative paths are placed in output_dir.
+    '''
+    return os.path.join(output_dir, output_file)
+
+def output_blocks(blocks, output_files, live=False, output_dir='outputs/'):
+    '''
+    Output blocks of text or bytes to several files in a single pass.
+
+    Blocks are written as they are produced, so they may be a lazy iterable, and they are gathered in a
+    large buffer before reaching the files. They go to temporary files that only replace the output files
+    once everything has been written, so a run that fails halfway never leaves a truncated output behind.
+    In live mode, they are instead written straight to the output files and flushed one by one, so they
+    can be read while the run goes on. An output file named STDOUT is written to the standard output.
+
     Parameters:
-        file_path -> str: The path to the input file.
-        
+        blocks -> iterable: Tuples with the text, encoded as UTF-8, or the bytes to append to each output file.
+        output_files -> list: The paths to the files where the output should be written, or STDOUT.
+        live -> bool: Whether every block is made visible in the output files as soon as it is written (optional).
+        output_dir -> str: The folder relative output paths are placed in (optional).
+
     Returns:
-        translations -> list: A list of dictionaries, each representing an event.
+        bool: True if the output was written, False otherwise.
     '''
+    files = []
+    # (temporary path, output path) of the files written so far
+    replacements = []
 
-    translations = deque()
-    translation_ids = set()
+    try:
+        for output_file in output_files:
+            if output_file == STDOUT:
+                files.append(sys.stdout.buffer)
+                continue
 
-    try:    
-        with open(file_path, 'r') as input_file:
-            for line in input_file:
-                translation = json.loads(line.strip())
+            output_file_path = output_path(output_file, output_dir)
+            temp_file_path = output_file_path if live else f'{output_file_path}.tmp'
+            files.append(open(temp_file_path, 'wb', buffering=OUTPUT_BUFFER_SIZE))
+            replacements.append((temp_file_path, output_file_path))
 
-                # Check for duplicate translations. We ignore duplicates and continue
-                if translation['translation_id'] in translation_ids:
-                    logging.info(f"Duplicate translation detected: {translation}")
-                    continue
-                translation_ids.add(translation['translation_id'])
+        for block in blocks:
+            for file, data in zip(files, block):
+                file.write(data.encode() if isinstance(data, str) else data)
+                if live:
+                    file.flush()
 
-                # Validate translation
-                if not (validate_translation(translation)):
-                    # No logging since validate_translation already logs the error
-                    return None
-                
-                # Convert timestamp to datetime objects for easier comparsion and calculation
-                translation['timestamp'] = datetime.strptime(translation['timestamp'], "%Y-%m-%d %H:%M:%S.%f")
-                translations.append(translation)
+        for file in files:
+            file.flush()
+            if file is not sys.stdout.buffer:
+                file.close()
+        if not live:
+            for temp_file_path, output_file_path in replacements:
+                os.replace(temp_file_path, output_file_path)
+        return True
 
+    except IOError as e:
+        logging.error(f'"File write error: {str(e)}')
+        return False
 
-    except FileNotFoundError:
-        logging.error(f"File {file_path} not found.")
-        return None
-    except ValueError:
-        logging.error(f"Invalid timestamp format in {file_path}.")
-        return None
-    except Exception as e:
-        logging.error(f"An unexpected error occured: {str(e)}")
-        return None
-    
-    logging.info("Input file has been parsed")
-    return translations
-    
+    finally:
+        for file in files:
+            if file is not sys.stdout.buffer:
+                file.close()
+        if not live:
+            for temp_file_path, _ in replacements:
+                if os.path.exists(temp_file_path):
+                    os.remove(temp_file_path)
 
-def calculate_moving_average(translations, window_size):
+def output_moving_average(moving_averages, output_file):
     '''
-    Calculate the moving average of translation delivery times per minute for a specified window size.
-    
+    Output the calculated moving averages to a file in the desired format.
+
+    Lines are written as they are produced, so moving_averages may be a lazy iterable. They go to a
+    temporary file that only replaces output_file once everything has been written, so a run that
+    fails halfway never leaves a truncated output behind.
+
     Parameters:
-        translations -> deque: A deque of translations, each represented as a dictionary.
-        window_size -> int: The size of the window for which the moving average is to be calculated.
-        
+        moving_averages -> iterable: Dictionaries, each containing a minute and the corresponding moving average.
+        output_file -> str: The path to the file where the output should be written.
+
     Returns:
-        moving_averages -> list: A list of dictionaries, each containing a minute and the corresponding moving average.
+        bool: True if the output was written, False otherwise.
     '''
+    return output_moving_averages(((avg,) for avg in moving_averages), [output_file])
 
-    moving_averages = []
-    window_queue = deque()
-    window_sum = 0
+def window_output_files(output_file, window_sizes):
+    '''
+    Name one output file per window size after output_file, e.g. output_5.txt for a 5 minute window.
+    '''
+    name, extension = os.path.splitext(output_file)
+    return [f'{name}_{window_size}{extension}' for window_size in window_sizes]
 
-    current_minute = translations[0]['timestamp'].replace(second=0, microsecond=0)
-    last_minute = translations[-1]['timestamp'].replace(second=0, microsecond=0) + timedelta(minutes=1)
-    
-    # Iterate through each minute from the first to the last translation
-    while current_minute <= last_minute:
-        average = 0
+# Identifies checkpoint files and the version of their layout
+CHECKPOINT_MAGIC = b'UBCKPT\x00\x01'
 
-        # Check for new translations that fall within the new window with the added minute
-        while translations and translations[0]['timestamp'] < current_minute:    
-            translation = translations.popleft()
-            window_sum += translation['duration']
-            window_queue.append(translation)
+def _write_struct(stream, layout, *values):
+    stream.write(struct.pack(layout, *values))
 
-        # Remove translations from the window that are older than the current minute minus the window_size   
-        while window_queue and window_queue[0]['timestamp'] <= current_minute - timedelta(minutes=window_size):
-            window_sum -= window_queue.popleft()['duration']
-        
-        # Calculate the average for the current minute
-        if window_queue:
-            average = window_sum / len(window_queue)
-        
-        # Store the average for the current minute
-        moving_averages.append({
-        "date": current_minute.strftime("%Y-%m-%d %H:%M:%S"),
-        "average_delivery_time": f'{average:g}'
-        })
+def _read_bytes(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated checkpoint")
+    return data
 
-        current_minute += timedelta(minutes=1)
-    
-    return moving_averages
+def _read_struct(stream, layout):
+    return struct.unpack(layout, _read_bytes(stream, struct.calcsize(layout)))
 
-def output_moving_average(moving_averages, output_file):
+def save_checkpoint(checkpoint_file, signature, input_offset, output_offsets, pending_bucket, windows, duplicate_filter):
     '''
-    Output the calculated moving averages to a file in the desired format.
-    
+    Atomically save the state of a run in a compact binary checkpoint.
+
+    The checkpoint is written to a temporary file, synced to disk and renamed over the previous one,
+    so a crash while saving always leaves the previous checkpoint intact.
+
     Parameters:
-        moving_averages -> list: A list of dictionaries, each containing a minute and the corresponding moving average.
-        output_file -> strS: The path to the file where the output should be written.
+        checkpoint_file -> str: The path to the checkpoint.
+        signature -> dict: The parameters of the run, which a resumed run must match.
+        input_offset -> int: The byte offset in the input up to which translations have been processed.
+        output_offsets -> list: The number of bytes written to each output file.
+        pending_bucket -> list: The aggregates of the minute being read, as in aggregate_minutes(), or None.
+        windows -> SlidingWindows: The state of the moving averages.
+        duplicate_filter -> DuplicateFilter: The state of the duplicate detection.
+    '''
+    temp_file_path = f'{checkpoint_file}.tmp'
+
+    with open(temp_file_path, 'wb') as stream:
+        stream.write(CHECKPOINT_MAGIC)
+        encoded_signature = json.dumps(signature, sort_keys=True).encode()
+        _write_struct(stream, '<I', len(encoded_signature))
+        stream.write(encoded_signature)
+
+        _write_struct(stream, '<QH', input_offset, len(output_offsets))
+        for output_offset in output_offsets:
+            _write_struct(stream, '<Q', output_offset)
+
+        _write_struct(stream, '<?', pending_bucket is not None)
+        if pending_bucket is not None:
+            _write_struct(stream, '<5q', *pending_bucket)
+
+        buckets = windows.buckets()
+        _write_struct(stream, '<?qI', windows.current_minute is not None, windows.current_minute or 0, len(buckets))
+        for bucket in buckets:
+            _write_struct(stream, '<5q', *bucket)
+
+        duplicate_filter.save_state(stream)
+
+        stream.flush()
+        os.fsync(stream.fileno())
+
+    os.replace(temp_file_path, checkpoint_file)
+
+def load_checkpoint(checkpoint_file, window_sizes, duplicate_filter):
+    '''
+    Load a checkpoint saved by save_checkpoint(), restoring the duplicate detection state into duplicate_filter.
+
+    Returns:
+        tuple: The signature, input offset, output offsets, pending bucket and SlidingWindows of the saved run.
+
+    Raises:
+        ValueError: If the file is not a valid checkpoint.
+    '''
+    with open(checkpoint_file, 'rb') as stream:
+        if stream.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError("Not a checkpoint file")
+        signature = json.loads(_read_bytes(stream, _read_struct(stream, '<I')[0]))
+
+        input_offset, output_count = _read_struct(stream, '<QH')
+        output_offsets = [_read_struct(stream, '<Q')[0] for _ in range(output_count)]
+
+        pending_bucket = list(_read_struct(stream, '<5q')) if _read_struct(stream, '<?')[0] else None
+
+        has_current_minute, current_minute, bucket_count = _read_struct(stream, '<?qI')
+        buckets = [_read_struct(stream, '<5q') for _ in range(bucket_count)]
+        windows = SlidingWindows(window_sizes, current_minute if has_current_minute else None, buckets)
+
+        duplicate_filter.load_state(stream)
+
+    return signature, input_offset, output_offsets, pending_bucket, windows
+
+def run_with_checkpoints(input_file, window_sizes, output_files, duplicate_filter, checkpoint_file,
+                         checkpoint_interval=60, resume=False, combine=False, decoder=None, output_dir='outputs/', stats=None):
+    '''
+    Calculate and write the moving averages like a regular run, periodically saving a checkpoint from
+    which an interrupted run can be resumed with exactly the same output.
+
+    A checkpoint holds the input byte offset reached, the minute being aggregated, the buckets still
+    inside the windows, the duplicate detection state and the size of each output file. The output is
+    written to temporary files that a resumed run truncates back to the checkpoint and appends to, and
+    that only replace the output files (and delete the checkpoint) once the whole input has been read.
+    A run that fails or is interrupted before any checkpoint refers to them removes them.
+
+    Parameters:
+        input_file -> str: The path to the input file, which may be compressed as in open_input().
+        window_sizes -> list: The sizes of the windows for which the moving averages are to be calculated.
+        output_files -> list: The paths to the files where the output should be written, as in output_moving_averages().
+        duplicate_filter -> DuplicateFilter: Detects repeated translations.
+        checkpoint_file -> str: The path to the checkpoint.
+        checkpoint_interval -> float: Seconds between checkpoints (optional).
+        resume -> bool: Whether to resume from the checkpoint, if there is one (optional).
+        combine -> bool: Whether all windows go into a single record per minute, with a key per window (optional).
+        decoder -> TranslationDecoder: Decodes the lines of the input (optional).
+        output_dir -> str: The folder relative output paths are placed in (optional).
+        stats -> RunStats: Records the metrics of the run (optional). Only parsing is timed as a stage of its own.
+
+    Returns:
+        bool: True if the output was written, False otherwise.
+
+    Raises:
+        InputError: If the file cannot be read or one of its translations is invalid.
     '''
+    if decoder is None:
+        decoder = TranslationDecoder()
+
+    output_file_paths = [output_path(output_file, output_dir) for output_file in output_files]
+    signature = {
+        'input_file': os.path.abspath(input_file),
+        'window_sizes': window_sizes,
+        'output_files': [os.path.abspath(output_file_path) for output_file_path in output_file_paths],
+        'combine': combine,
+        'duplicate_filter': [duplicate_filter.horizon, duplicate_filter.mode, duplicate_filter.capacity, duplicate_filter.error_rate],
+    }
+    temp_file_paths = [f'{output_file_path}.tmp' for output_file_path in output_file_paths]
+
+    input_offset = 0
+    output_offsets = [0] * len(output_files)
+    pending_bucket = None
+    windows = SlidingWindows(window_sizes)
+
+    if resume and os.path.exists(checkpoint_file):
+        try:
+            saved_signature, input_offset, output_offsets, pending_bucket, windows = load_checkpoint(checkpoint_file, window_sizes, duplicate_filter)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            logging.error(f"Invalid checkpoint {checkpoint_file}: {str(e)}")
+            return False
+
+        if saved_signature != signature:
+            logging.error(f"Checkpoint {checkpoint_file} was saved by a run with different arguments")
+            return False
+        if any(not os.path.exists(path) or os.path.getsize(path) < offset for path, offset in zip(temp_file_paths, output_offsets)):
+            logging.error(f"The partial output of checkpoint {checkpoint_file} is missing")
+            return False
+        logging.info(f"Resuming from byte {input_offset} of {input_file}")
+
+    elif resume:
+        logging.info(f"No checkpoint found at {checkpoint_file}, starting from the beginning")
+
+    # Whether a checkpoint refers to the temporary files, which must then be kept if the run fails
+    checkpointed = bool(resume and os.path.exists(checkpoint_file))
+
+    # Byte offset in the input of the end of the last line read
+    position = input_offset
+
+    def lines():
+        nonlocal position
+        with open_input(input_file) as file:
+            for line in _read_lines(file, input_offset):
+                position += len(line)
+                yield line
+
+    def write(runs):
+        for block in format_average_runs(runs, window_sizes, combine):
+            for file, text in zip(files, block):
+                file.write(text.encode())
+
+    translations = _read_translations(input_file, duplicate_filter, lines=lines(), decoder=decoder)
+    if stats is not None:
+        stats.windows = windows
+        translations = stats.stage('parse', translations)
+
+    files = []
     try:
-        output_file_path = os.path.join('outputs/',output_file)
-        with open(output_file_path, 'w') as file:
-            for avg in moving_averages:
-                file.write(f'{json.dumps(avg)}\n')
-    
+        for temp_file_path, output_offset in zip(temp_file_paths, output_offsets):
+            file = open(temp_file_path, 'r+b' if output_offset else 'wb', buffering=OUTPUT_BUFFER_SIZE)
+            file.truncate(output_offset)
+            file.seek(output_offset)
+            files.append(file)
+
+        last_checkpoint = time.monotonic()
+        for translation, timestamp in translations:
+            minute, offset = divmod(timestamp, MICROSECONDS_PER_MINUTE)
+            if pending_bucket is None or pending_bucket[0] != minute:
+                if pending_bucket is not None:
+                    write(windows.add_runs(tuple(pending_bucket)))
+                pending_bucket = [minute, 0, 0, 0, 0]
+
+            _add_to_bucket(pending_bucket, offset, translation['duration'])
+
+            if time.monotonic() - last_checkpoint >= checkpoint_interval:
+                # The output must be on disk before the checkpoint that refers to it
+                for file in files:
+                    file.flush()
+                    os.fsync(file.fileno())
+                save_checkpoint(checkpoint_file, signature, position, [file.tell() for file in files], pending_bucket, windows, duplicate_filter)
+                checkpointed = True
+                last_checkpoint = time.monotonic()
+
+        _log_parse_summary(duplicate_filter.hits, duplicate_filter.misses, decoder.invalid)
+
+        if pending_bucket is not None:
+            write(windows.add_runs(tuple(pending_bucket)))
+        write((minute, minute + 1, averages) for minute, averages in windows.finish())
+
+        for file in files:
+            file.close()
+
+        if windows.current_minute is None:
+            # Empty input: there is nothing to output
+            for temp_file_path in temp_file_paths:
+                os.remove(temp_file_path)
+            return False
+
+        for temp_file_path, output_file_path in zip(temp_file_paths, output_file_paths):
+            os.replace(temp_file_path, output_file_path)
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        return True
+
+    except (InputError, KeyboardInterrupt):
+        # A partial output no checkpoint refers to can never be resumed
+        if not checkpointed:
+            for file in files:
+                file.close()
+            for temp_file_path in temp_file_paths:
+                if os.path.exists(temp_file_path):
+                    os.remove(temp_file_path)
+        raise
+
     except IOError as e:
         logging.error(f'"File write error: {str(e)}')
+        return False
+
+    finally:
+        for file in files:
+            file.close()
+
+# Header of the minute index files
+INDEX_MAGIC = b'UBINDEX\x01'
+
+# Fields of each minute in a minute index: its minute, the byte offset of its first line and its aggregates
+_INDEX_FIELDS = 6
+
+def minute_index_signature(file_path, duplicate_filter_options, on_invalid):
+    '''
+    The state of an input file and the options its minute index depends on. An index whose signature
+    differs was built from another version of the input, or with other options, and must be rebuilt.
+
+    Raises:
+        OSError: If the file cannot be read.
+    '''
+    status = os.stat(file_path)
+    return {
+        'size': status.st_size,
+        'mtime_ns': status.st_mtime_ns,
+        'duplicate_filter': [duplicate_filter_options.get(key) for key in ('horizon', 'mode', 'capacity', 'error_rate')],
+        'on_invalid': on_invalid,
+    }
+
+class MinuteIndex:
+    '''
+    Sidecar index of an input file sorted by timestamp, which answers a time range without reading the
+    whole input again: either straight from the aggregates of its minutes, or by reading only its lines.
+
+    A range of minutes is extended with the last minute with translations before it and the first one at
+    or after its end, so that the moving averages calculated over the range are those of a full run for
+    every minute of the range, provided the range starts with the minutes its windows start in.
+
+    Parameters:
+        signature -> dict: The signature of the input, as returned by minute_index_signature().
+        minutes -> array: For each minute with translations, its minute, the byte offset of its first line and its
+                          sum, count, boundary sum and boundary count as in aggregate_minutes(), one after the other.
+        skipped -> array: The byte offsets of the lines skipped as duplicates or invalid lines, in increasing order.
+    '''
+
+    def __init__(self, signature, minutes, skipped):
+        self.signature = signature
+        self.minutes = minutes
+        self.skipped = skipped
+        self._minutes = minutes[0::_INDEX_FIELDS]
+
+    def __len__(self):
+        return len(self._minutes)
+
+    def _span(self, first_minute, last_minute):
+        # The minutes with translations from the last one before first_minute to the first one at or after last_minute
+        start = max(bisect_left(self._minutes, first_minute) - 1, 0)
+        end = min(bisect_left(self._minutes, last_minute) + 1, len(self._minutes))
+        return start, end
 
-def parse_cli_arguments():
+    def buckets(self, first_minute=-math.inf, last_minute=math.inf):
+        '''
+        Yield the aggregates of the minutes with translations from first_minute to last_minute, extended as above.
+
+        Yields:
+            bucket -> tuple: (minute, sum, count, boundary_sum, boundary_count), as produced by aggregate_minutes().
+        '''
+        start, end = self._span(first_minute, last_minute)
+        for i in range(start * _INDEX_FIELDS, end * _INDEX_FIELDS, _INDEX_FIELDS):
+            yield (self.minutes[i],) + tuple(self.minutes[i + 2:i + _INDEX_FIELDS])
+
+    def lines(self, file_path, first_minute=-math.inf, last_minute=math.inf):
+        '''
+        Yield the lines of the minutes from first_minute to last_minute, extended as above, from the memory
+        mapped input file, leaving out the lines skipped when the index was built.
+        '''
+        start, end = self._span(first_minute, last_minute)
+        if start == end:
+            return
+
+        start_offset = self.minutes[start * _INDEX_FIELDS + 1]
+        end_offset = self.minutes[end * _INDEX_FIELDS + 1] if end < len(self._minutes) else self.signature['size']
+        skipped = bisect_left(self.skipped, start_offset)
+
+        with open(file_path, 'rb') as input_file, mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = start_offset
+            while position < end_offset:
+                line_end = mapped.find(b'\n', position, end_offset) + 1 or end_offset
+                if skipped < len(self.skipped) and self.skipped[skipped] == position:
+                    skipped += 1
+                else:
+                    yield mapped[position:line_end]
+                position = line_end
+
+class MinuteIndexBuilder:
+    '''
+    Build the minute index of an input file during a regular run: lines() reads the file, keeping track of
+    the byte offset of each line, and events() watches the events decoded from those lines one at a time.
+    The lines read but not decoded into events are the skipped ones.
+
+    Parameters:
+        file_path -> str: The path to the uncompressed input file.
+        signature -> dict: The signature of the input, as returned by minute_index_signature().
+    '''
+
+    def __init__(self, file_path, signature):
+        self.file_path = file_path
+        self.signature = signature
+        self.minutes = array('q')
+        self.skipped = array('q')
+        self.complete = False
+        self._sorted = True
+        self._position = 0
+        # Byte offsets of the lines read since the last event
+        self._pending = []
+
+    def lines(self):
+        with open_input(self.file_path) as input_file:
+            for line in input_file:
+                self._pending.append(self._position)
+                self._position += len(line)
+                yield line
+
+    def events(self, events):
+        bucket = None
+        # Byte offset of the first line of the bucket's minute
+        bucket_offset = None
+
+        for event in events:
+            offset = self._pending.pop()
+            self.skipped.extend(self._pending)
+            self._pending.clear()
+
+            minute, remainder = divmod(event[0], MICROSECONDS_PER_MINUTE)
+            if bucket is None or bucket[0] != minute:
+                if bucket is not None:
+                    self._sorted = self._sorted and minute > bucket[0]
+                    self.minutes.extend((bucket[0], bucket_offset, *bucket[1:]))
+                bucket = [minute, 0, 0, 0, 0]
+                bucket_offset = offset
+
+            _add_to_bucket(bucket, remainder, event[1])
+            yield event
+
+        if bucket is not None:
+            self.minutes.extend((bucket[0], bucket_offset, *bucket[1:]))
+        self.skipped.extend(self._pending)
+        self.complete = True
+
+    def index(self):
+        '''
+        Returns:
+            MinuteIndex: The index, or None if the input was not read to the end, was not sorted by timestamp
+                         or changed while it was read.
+        '''
+        if not (self.complete and self._sorted and self._position == self.signature['size']):
+            return None
+        return MinuteIndex(self.signature, self.minutes, self.skipped)
+
+def save_minute_index(index_file, index):
+    '''
+    Atomically save a minute index. Integers are stored as little endian int64.
+    '''
+    temp_file_path = f'{index_file}.tmp'
+
+    with open(temp_file_path, 'wb') as stream:
+        stream.write(INDEX_MAGIC)
+        encoded_signature = json.dumps(index.signature, sort_keys=True).encode()
+        _write_struct(stream, '<I', len(encoded_signature))
+        stream.write(encoded_signature)
+
+        _write_struct(stream, '<QQ', len(index), len(index.skipped))
+        stream.write(index.minutes.tobytes())
+        stream.write(index.skipped.tobytes())
+
+    os.replace(temp_file_path, index_file)
+
+def load_minute_index(index_file):
+    '''
+    Load a minute index saved by save_minute_index().
+
+    Raises:
+        ValueError: If the file is not a valid minute index.
+    '''
+    with open(index_file, 'rb') as stream:
+        if stream.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError("Not an index file")
+        signature = json.loads(_read_bytes(stream, _read_struct(stream, '<I')[0]))
+
+        minute_count, skipped_count = _read_struct(stream, '<QQ')
+        minutes = array('q', _read_bytes(stream, minute_count * _INDEX_FIELDS * 8))
+        skipped = array('q', _read_bytes(stream, skipped_count * 8))
+
+    return MinuteIndex(signature, minutes, skipped)
+
+def open_minute_index(index_file, signature):
+    '''
+    Load the minute index of an input file if it exists and matches the current signature of the input.
+
+    Returns:
+        MinuteIndex: The index, or None if it is missing, invalid or out of date.
+    '''
+    if not os.path.exists(index_file):
+        return None
+
+    try:
+        index = load_minute_index(index_file)
+    except (OSError, ValueError, UnicodeDecodeError) as e:
+        logging.warning(f"Invalid index {index_file}: {str(e)}, rebuilding it")
+        return None
+
+    if index.signature != signature:
+        logging.info(f"The index {index_file} was built from another version of the input or with other options, rebuilding it")
+        return None
+    return index
+
+def parse_cli_arguments(argv=None):
     '''
     Parses command line arguments for the program.
+
+    Parameters:
+        argv -> list: The arguments to parse (optional). Defaults to the ones the program was called with.
         
     Returns:
         args -> The parsed command line arguments 
@@ -132,19 +2578,184 @@ def parse_cli_arguments():
     
     # Argument parser for CLI
     parser = argparse.ArgumentParser(description="Calculate moving average of translation delivery times.")
-    parser.add_argument("--input_file", required=True, help="Path to the input file containing translations.")
-    parser.add_argument("--window_size", required=True, type=int, help="The window size in minutes for moving average calculation.")
-    parser.add_argument("--output_file", default="output.txt", help="Path to desired output file (optional). It will be placed in the outputs/ folder")
+    parser.add_argument("--input_file", required=True, nargs='+', help="Path to the input file containing translations, which may be compressed (.gz, .xz or .bz2). Several files or glob patterns can be given, each file sorted by timestamp, to merge them into a single sorted stream.")
+    parser.add_argument("--window_size", required=True, type=int, nargs='+', help="The window size in minutes for moving average calculation. Several sizes can be given to calculate them all in a single pass.")
+    parser.add_argument("--output_file", default="output.txt", help="Path to desired output file (optional), or - for the standard output. Relative paths are placed in the output folder. With several window sizes, one file per size is written, named after it (e.g. output_5.txt).")
+    parser.add_argument("--output_dir", default="outputs/", help="Folder relative output paths are placed in (optional). Defaults to outputs/.")
+    parser.add_argument("--output_format", choices=OUTPUT_FORMATS, default="json", help="One JSON line per minute, one JSON line per run of consecutive minutes with the same average, CSV, or columnar binary (optional).")
+    parser.add_argument("--combine_windows", action="store_true", help="With several window sizes, write a single output file with one record per minute holding the averages of every window (optional).")
+    parser.add_argument("--follow", action="store_true", help="Keep reading lines appended to the input file, like tail -f, writing each minute as soon as it closes (optional).")
+    parser.add_argument("--poll_interval", type=float, default=1.0, help="Seconds between checks for new lines in follow mode (optional).")
+    parser.add_argument("--idle_timeout", type=float, help="Stop following after this many seconds without new lines (optional). Defaults to following until interrupted.")
+    parser.add_argument("--percentiles", type=float, nargs='+', help="Also estimate these percentiles of the delivery times in each window, e.g. 50 95 99 (optional).")
+    parser.add_argument("--percentile_accuracy", type=float, default=0.01, help="Relative accuracy of the estimated percentiles (optional). Defaults to 1%%.")
+    parser.add_argument("--group_by", nargs='+', choices=GROUP_FIELDS, help="Calculate one moving average per value of these fields, e.g. client_name or source_language target_language (optional).")
+    parser.add_argument("--engine", choices=ENGINES, default="python", help="Streaming pure Python engine or vectorized NumPy engine (optional). The NumPy engine loads every event in memory.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes splitting the input file between them (optional). Requires --dedup_horizon.")
+    parser.add_argument("--dedup_horizon", type=int, help="Minutes during which a translation id is remembered to detect duplicates (optional). Defaults to remembering every id.")
+    parser.add_argument("--dedup_mode", choices=DuplicateFilter.MODES, default="exact", help="Remember translation ids exactly or in fixed-size Bloom filters (optional).")
+    parser.add_argument("--dedup_capacity", type=int, default=1_000_000, help="Number of ids each Bloom filter is sized for (optional).")
+    parser.add_argument("--dedup_error_rate", type=float, default=0.001, help="False positive rate of each Bloom filter at full capacity (optional).")
+    parser.add_argument("--decoder", choices=TranslationDecoder.MODES, default="json", help="Decode every line with json.loads, or only fall back to it for lines not in the usual layout (optional).")
+    parser.add_argument("--on_invalid", choices=TranslationDecoder.POLICIES, default="abort", help="Abort on the first invalid line, or skip and count invalid lines (optional).")
+    parser.add_argument("--allowed_lateness", type=float, help="Sort translations read out of order by up to this many seconds, dropping those later than that (optional). Defaults to expecting the input sorted by timestamp.")
+    parser.add_argument("--late_file", help="Write the late translations dropped to this file, as they were read from the input, instead of only counting them (optional). Relative paths are placed in the output folder.")
+    parser.add_argument("--checkpoint_file", help="Periodically save the progress of the run to this file, so it can be resumed after a crash (optional).")
+    parser.add_argument("--checkpoint_interval", type=float, default=60, help="Seconds between checkpoints (optional).")
+    parser.add_argument("--resume", action="store_true", help="Resume from the checkpoint file, if it exists (optional).")
+    parser.add_argument("--from", dest="from_date", nargs='+', metavar="DATE", help="Only output the minutes from this one, as YYYY-MM-DD HH:MM (optional).")
+    parser.add_argument("--to", dest="to_date", nargs='+', metavar="DATE", help="Only output the minutes up to this one included, as YYYY-MM-DD HH:MM, or HH:MM on the day given to --from (optional).")
+    parser.add_argument("--index", nargs='?', const='', help="Keep a sidecar index of the minutes of the input in this file, or next to the input file if no file is given, built by the first run and used by the next ones to only read the requested range, or to answer from the per minute aggregates (optional).")
+    parser.add_argument("--stats", nargs='?', const='', help="Record the time spent per stage, lines per second, duplicate and invalid line counters, peak window depth and peak memory usage, and write them as JSON to this file, or log them if no file is given (optional).")
+    parser.add_argument("--progress_interval", type=float, help="Log a progress line every this many seconds (optional).")
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    # Input validation: glob patterns are expanded in sorted order, and other paths are kept as they are
+    input_files = []
+    for pattern in args.input_file:
+        if glob.escape(pattern) == pattern:
+            input_files.append(pattern)
+            continue
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            logging.error(f"Error: No input file matches {pattern}")
+            return
+        input_files.extend(matches)
+    args.input_file = list(dict.fromkeys(input_files))
+
+    single_plain_input = len(args.input_file) == 1 and not is_compressed(args.input_file[0])
+    if args.follow and not single_plain_input:
+        logging.error("Error: Follow mode requires a single uncompressed input file")
+        return
+    if args.workers > 1 and not single_plain_input:
+        logging.error("Error: Multiple workers require a single uncompressed input file")
+        return
+    if args.checkpoint_file and len(args.input_file) > 1:
+        logging.error("Error: Checkpoints require a single input file")
+        return
 
     # Window size validation
-    if args.window_size <= 0:
+    if any(window_size <= 0 for window_size in args.window_size):
         logging.error("Error: Window size must be a positive integer")
         return
+    args.window_size = list(dict.fromkeys(args.window_size))
+
+    if args.engine == 'numpy' and np is None:
+        logging.error("Error: The numpy engine requires NumPy to be installed")
+        return
+
+    # Follow mode validation
+    if args.follow and (len(args.window_size) > 1 or args.group_by or args.engine != 'python' or args.workers > 1):
+        logging.error("Error: Follow mode requires a single window size, no grouping, the python engine and a single worker")
+        return
+    if args.poll_interval <= 0:
+        logging.error("Error: Poll interval must be a positive number")
+        return
+
+    # Percentiles validation
+    if args.percentiles and (len(args.window_size) > 1 or args.follow or args.group_by or args.engine != 'python' or args.workers > 1 or args.checkpoint_file):
+        logging.error("Error: Percentiles require a single window size, no follow mode, no grouping, the python engine, a single worker and no checkpoints")
+        return
+    if args.percentiles and any(not 0 <= percentile <= 100 for percentile in args.percentiles):
+        logging.error("Error: Percentiles must be between 0 and 100")
+        return
+    if not 0 < args.percentile_accuracy < 1:
+        logging.error("Error: Percentile accuracy must be between 0 and 1")
+        return
+
+    # Grouping validation
+    if args.group_by and (len(args.window_size) > 1 or args.engine != 'python' or args.workers > 1):
+        logging.error("Error: Grouping requires a single window size, the python engine and a single worker")
+        return
+
+    # Parallel processing validation
+    if args.workers <= 0:
+        logging.error("Error: Number of workers must be a positive integer")
+        return
+    if args.workers > 1 and args.dedup_horizon is None:
+        logging.error("Error: Multiple workers require a duplicate detection horizon")
+        return
+    if args.workers > 1 and args.engine != 'python':
+        logging.error("Error: Multiple workers can only be used with the python engine")
+        return
+
+    # Duplicate detection validation
+    if args.dedup_horizon is not None and args.dedup_horizon <= 0:
+        logging.error("Error: Duplicate detection horizon must be a positive integer")
+        return
+    if args.dedup_capacity <= 0:
+        logging.error("Error: Duplicate detection capacity must be a positive integer")
+        return
+    if not 0 < args.dedup_error_rate < 1:
+        logging.error("Error: Duplicate detection error rate must be between 0 and 1")
+        return
+
+    # Output validation
+    if args.output_format != 'json' and (args.follow or args.group_by or args.percentiles or args.checkpoint_file):
+        logging.error(f"Error: The {args.output_format} output format cannot be combined with follow mode, grouping, percentiles or checkpoints")
+        return
+    if args.output_file == STDOUT and ((len(args.window_size) > 1 and not args.combine_windows) or args.checkpoint_file):
+        logging.error("Error: The standard output requires a single output file and no checkpoints")
+        return
+
+    # Checkpoint validation
+    if args.resume and not args.checkpoint_file:
+        logging.error("Error: Resuming requires a checkpoint file")
+        return
+    if args.checkpoint_file and (args.follow or args.group_by or args.engine != 'python' or args.workers > 1):
+        logging.error("Error: Checkpoints require no follow mode, no grouping, the python engine and a single worker")
+        return
+    if args.checkpoint_interval < 0:
+        logging.error("Error: Checkpoint interval must not be negative")
+        return
+
+    # Reordering validation
+    if args.allowed_lateness is not None and args.allowed_lateness < 0:
+        logging.error("Error: Allowed lateness must not be negative")
+        return
+    if args.late_file and args.allowed_lateness is None:
+        logging.error("Error: A late file requires an allowed lateness")
+        return
+    if args.allowed_lateness is not None and (args.workers > 1 or args.checkpoint_file):
+        logging.error("Error: Allowed lateness requires a single worker and no checkpoints")
+        return
+
+    # Range validation
+    args.from_minute = args.to_minute = None
+    try:
+        if args.from_date:
+            args.from_minute = _parse_minute(' '.join(args.from_date))
+        if args.to_date:
+            to_date = ' '.join(args.to_date)
+            if args.from_date and ' ' not in to_date:
+                to_date = f"{' '.join(args.from_date).split()[0]} {to_date}"
+            args.to_minute = _parse_minute(to_date)
+    except ValueError:
+        logging.error("Error: The range must be given as YYYY-MM-DD HH:MM")
+        return
+    if args.from_minute is not None and args.to_minute is not None and args.to_minute < args.from_minute:
+        logging.error("Error: The end of the range must not be before its start")
+        return
+    if (args.from_date or args.to_date) and (args.follow or args.checkpoint_file):
+        logging.error("Error: A range cannot be combined with follow mode or checkpoints")
+        return
+
+    # Index validation
+    if args.index is not None and (not single_plain_input or args.follow or args.workers > 1 or args.checkpoint_file or args.allowed_lateness is not None):
+        logging.error("Error: The index requires a single uncompressed input file, no follow mode, a single worker, no checkpoints and no allowed lateness")
+        return
+
+    # Statistics validation
+    if args.progress_interval is not None and args.progress_interval <= 0:
+        logging.error("Error: Progress interval must be a positive number")
+        return
     
     return args
 
+def _parse_minute(date):
+    return to_timestamp(datetime.strptime(date, "%Y-%m-%d %H:%M")) // MICROSECONDS_PER_MINUTE
+
 def validate_translation(translation):
     '''
     Validate the data types and keys of a translation event.
@@ -155,44 +2766,204 @@ def validate_translation(translation):
     Returns:
         bool: True if the translation is valid, False otherwise.
     '''
-    expected_types = {
-        "timestamp": str,
-        "translation_id": str,
-        "source_language": str,
-        "target_language": str,
-        "client_name": str,
-        "event_name": str,
-        "nr_words": int,
-        "duration": int
-    }
-
-    # Checks for additional or missing keys
-    if set(translation.keys()) != set(expected_types.keys()):
-        logging.error(f"Set of keys different than expected in translation: {translation}")
+    problem = _translation_error(translation)
+    if problem is not None:
+        # The translation is only formatted if the error is actually logged
+        logging.error("%s in translation: %s", problem, translation)
         return False
-    
-    # Checks the data type of each key
-    for key, expected_type in expected_types.items():
-        if not isinstance(translation[key], expected_type):
-            logging.error(f"Incorrect data type for key '{key}' in translation: {translation}")
-            return False
-    
+
     return True
 
-def main():
-    args = parse_cli_arguments()
+def write_stats(summary, stats_file=''):
+    '''
+    Write the metrics of a run as JSON to stats_file, or log them if no file is given.
+    '''
+    if not stats_file:
+        logging.info(f"Run statistics: {json.dumps(summary)}")
+        return
+
+    try:
+        with open(stats_file, 'w') as file:
+            file.write(f'{json.dumps(summary, indent=2)}\n')
+        logging.info(f"Run statistics have been saved in {stats_file}")
+    except IOError as e:
+        logging.error(f"Error: Could not write the run statistics: {str(e)}")
 
-    translations = parse_input(args.input_file)
-    if not translations:
+def main(argv=None):
+    args = parse_cli_arguments(argv)
+    if not args:
         return
-    
-    logging.info("There are existing translations, proceeding with moving average calculations")
 
-    moving_averages = calculate_moving_average(translations, args.window_size)
-    logging.info("Moving averages have been calculated")
+    duplicate_filter_options = {
+        'horizon': args.dedup_horizon,
+        'mode': args.dedup_mode,
+        'capacity': args.dedup_capacity,
+        'error_rate': args.dedup_error_rate,
+    }
+    decoder_options = {
+        'mode': args.decoder,
+        'on_invalid': args.on_invalid,
+        'fields': args.group_by or (),
+    }
+
+    if len(args.window_size) == 1 or args.combine_windows:
+        output_files = [args.output_file]
+    else:
+        output_files = window_output_files(args.output_file, args.window_size)
+
+    def log_output_files():
+        for output_file in output_files:
+            if output_file != STDOUT:
+                logging.info(f"Output has been generated and saved in {output_path(output_file, args.output_dir)}")
+
+    # A single input file is read as is, several are merged
+    input_file = args.input_file[0] if len(args.input_file) == 1 else args.input_file
+
+    # Several workers each have their own duplicate filter and decoder
+    duplicate_filter = DuplicateFilter(**duplicate_filter_options) if args.workers == 1 else None
+    decoder = TranslationDecoder(**decoder_options) if args.workers == 1 else None
+
+    # The index is used if it is up to date, and built by this run otherwise
+    index = builder = None
+    if args.index is not None:
+        index_file = args.index or f'{input_file}.idx'
+        try:
+            signature = minute_index_signature(input_file, duplicate_filter_options, args.on_invalid)
+        except OSError:
+            logging.error(f"File {input_file} not found.")
+            return
+        index = open_minute_index(index_file, signature)
+        if index is None:
+            builder = MinuteIndexBuilder(input_file, signature)
+        else:
+            logging.info(f"Reading the minutes of the range from the index {index_file}")
+            # The lines skipped by the run that built the index are left out, so only the duplicates within the range are left
+            duplicate_filter = DuplicateFilter(args.dedup_horizon)
+
+    # Late translations are routed to their own file, if one is given
+    late_file = None
+    if args.late_file:
+        try:
+            late_file = open(output_path(args.late_file, args.output_dir), 'wb')
+        except IOError as e:
+            logging.error(f"Error: Could not open the late file: {str(e)}")
+            return
+
+    def write_late(translation, timestamp, line):
+        # The last line of the input may not end with a newline
+        late_file.write(line if line.endswith(b'\n') else line + b'\n')
+
+    reorder_buffer = None
+    if args.allowed_lateness is not None:
+        reorder_buffer = ReorderBuffer(args.allowed_lateness, write_late if late_file is not None else None)
+
+    stats = None
+    if args.stats is not None or args.progress_interval:
+        stats = RunStats(duplicate_filter, decoder, args.progress_interval, reorder_buffer)
+
+    def stage(name, items):
+        return stats.stage(name, items) if stats is not None else items
+
+    try:
+        if args.checkpoint_file:
+            if run_with_checkpoints(input_file, args.window_size, output_files, duplicate_filter, args.checkpoint_file,
+                                    args.checkpoint_interval, args.resume, args.combine_windows, decoder, args.output_dir, stats):
+                log_output_files()
+            return
+
+        # The windows of the engines calculating over per minute aggregates, whose depth is reported
+        windows = SlidingWindows(args.window_size)
+        if stats is not None and not (args.follow or args.group_by or (args.engine != 'python' and index is None)):
+            stats.windows = windows
+
+        # The minutes to read, starting with those the windows of the first minute of the range start in
+        first_minute = -math.inf if args.from_minute is None else args.from_minute
+        last_minute = math.inf if args.to_minute is None else args.to_minute
+        read_range = (first_minute - max(args.window_size), last_minute)
+
+        def read(group_by=None):
+            lines = None
+            if index is not None:
+                lines = index.lines(input_file, *read_range)
+            elif builder is not None:
+                lines = builder.lines()
+            events = read_events(input_file, duplicate_filter, group_by, lines=lines, decoder=decoder, reorder_buffer=reorder_buffer)
+            return stage('parse', builder.events(events) if builder is not None else events)
+
+        if args.follow:
+            # The event level engine closes each minute as soon as a later translation is read
+            lines = follow_lines(input_file, args.poll_interval, args.idle_timeout)
+            events = stage('parse', read_events(input_file, duplicate_filter, lines=lines, decoder=decoder, reorder_buffer=reorder_buffer))
+            averages = stream_window_averages(events, args.window_size[0])
+        elif args.percentiles:
+            averages = percentile_window_averages(read(), args.window_size[0], args.percentiles, args.percentile_accuracy, windows)
+        elif args.group_by:
+            averages = grouped_window_averages(aggregate_group_minutes(read(args.group_by)), args.window_size[0])
+        elif args.workers > 1:
+            # Each process aggregates its own range of the input per minute, and a single pass computes the windows
+            buckets = stage('parse', read_buckets_parallel(input_file, args.workers, duplicate_filter_options, decoder_options, stats))
+            averages = window_average_runs(buckets, args.window_size, windows)
+        elif index is not None:
+            # The per minute aggregates of the index answer without reading the input
+            averages = window_average_runs(stage('parse', index.buckets(*read_range)), args.window_size, windows)
+        else:
+            # The other engines are calculated as runs of minutes with the same averages
+            averages = ENGINES[args.engine](read(), args.window_size, windows)
+
+        if args.from_minute is not None or args.to_minute is not None:
+            if args.percentiles or args.group_by:
+                averages = (minute_averages for minute_averages in averages if first_minute <= minute_averages[0] <= last_minute)
+            else:
+                averages = clip_runs(averages, first_minute, last_minute)
+        averages = stage('window', averages)
+
+        first_average = next(averages, None)
+        if first_average is None:
+            return
+
+        logging.info("There are existing translations, proceeding with moving average calculations")
+
+        # Parsing, calculation and writing are chained lazily, so each minute is written as soon as it closes
+        averages = chain([first_average], averages)
+        if args.group_by:
+            written = output_moving_averages(format_group_averages(averages, args.group_by), output_files, output_dir=args.output_dir)
+        elif args.percentiles:
+            written = output_moving_averages(format_percentile_averages(averages, args.percentiles), output_files, output_dir=args.output_dir)
+        elif args.follow:
+            runs = ((minute, minute + 1, minute_averages) for minute, minute_averages in averages)
+            written = output_blocks(format_average_runs(runs, args.window_size), output_files, live=True, output_dir=args.output_dir)
+        else:
+            blocks = format_average_runs(averages, args.window_size, args.combine_windows, args.output_format)
+            written = output_blocks(blocks, output_files, output_dir=args.output_dir)
+        if written:
+            log_output_files()
+
+    except InputError:
+        return
+    except KeyboardInterrupt:
+        if args.checkpoint_file:
+            logging.info(f"Interrupted, the run can be resumed from {args.checkpoint_file} with --resume")
+        elif args.follow:
+            logging.info("Interrupted, the output holds every minute closed so far")
+        else:
+            # Outside follow mode, the output files are only replaced once the run completes
+            logging.info("Interrupted, no output file was written")
 
-    output_moving_average(moving_averages, args.output_file)
-    logging.info(f"Output has been generated and saved in {os.path.join('outputs/', args.output_file)}")
+    finally:
+        # The index is only saved once the whole input has been read
+        built_index = builder.index() if builder is not None else None
+        if built_index is not None:
+            try:
+                save_minute_index(index_file, built_index)
+                logging.info(f"Index has been saved in {index_file}")
+            except IOError as e:
+                logging.error(f"Error: Could not write the index: {str(e)}")
+        if late_file is not None:
+            late_file.close()
+            if reorder_buffer.late:
+                logging.info(f"Late translations have been saved in {late_file.name}")
+        if args.stats is not None:
+            write_stats(stats.summary(), args.stats)
 
 if __name__ == "__main__":
     main()
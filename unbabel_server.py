@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+from datetime import datetime
+import json
+import logging
+import os
+import socket
+
+from unbabel_cli import MICROSECONDS_PER_MINUTE, DuplicateFilter, RateLimitedLog, TranslationDecoder, format_minute, to_timestamp
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s',
+                    handlers=[logging.StreamHandler()])
+
+# Bytes read from a connection at a time, split into lines in one go
+READ_SIZE = 1 << 16
+# Longest line accepted before a connection is dropped
+MAX_LINE_LENGTH = 1 << 20
+# Pending connections queued by the listening socket
+BACKLOG = 4096
+
+class MinuteRing:
+    '''
+    Per minute aggregates of the last size minutes, in a ring buffer indexed by minute modulo size.
+
+    As in aggregate_minutes(), each minute holds the sum and count of the durations of its events,
+    separately for the events exactly on its start, which leave a window one minute earlier. Fenwick
+    trees over the slots hold their prefix sums, so adding an event and totalling any range of minutes
+    both take O(log size), whatever the order events arrive in. Moving to a later minute clears the
+    slots of the minutes that fall out of the ring.
+
+    Parameters:
+        size -> int: The number of minutes kept.
+
+    Attributes:
+        latest -> int: The latest minute with an event, counted from EPOCH, or None before the first event.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.latest = None
+        # Aggregates of each slot, and the Fenwick trees of (sum, count, boundary_sum, boundary_count)
+        self._slots = [[0, 0, 0, 0] for _ in range(size)]
+        self._trees = [[0] * (size + 1) for _ in range(4)]
+
+    @property
+    def oldest(self):
+        '''
+        The oldest minute kept.
+        '''
+        return self.latest - self.size + 1
+
+    def add(self, timestamp, duration):
+        '''
+        Add an event to the aggregates of its minute.
+
+        Parameters:
+            timestamp -> int: The timestamp of the event in microseconds since EPOCH.
+            duration -> int: The duration of the event.
+
+        Returns:
+            bool: True if the event was added, False if its minute is older than the ring.
+        '''
+        minute, offset = divmod(timestamp, MICROSECONDS_PER_MINUTE)
+        if self.latest is None:
+            self.latest = minute
+        elif minute > self.latest:
+            self._advance(minute)
+        elif minute < self.oldest:
+            return False
+
+        self._update(minute % self.size, 0 if offset else 2, duration)
+        return True
+
+    def _update(self, slot, kind, duration):
+        self._slots[slot][kind] += duration
+        self._slots[slot][kind + 1] += 1
+        durations, counts = self._trees[kind], self._trees[kind + 1]
+        index = slot + 1
+        while index <= self.size:
+            durations[index] += duration
+            counts[index] += 1
+            index += index & -index
+
+    def _advance(self, minute):
+        # Clear the slots reused by the minutes after latest, up to minute
+        for cleared in range(max(self.latest + 1, minute - self.size + 1), minute + 1):
+            slot = cleared % self.size
+            values = self._slots[slot]
+            if any(values):
+                index = slot + 1
+                while index <= self.size:
+                    for tree, value in zip(self._trees, values):
+                        tree[index] -= value
+                    index += index & -index
+                self._slots[slot] = [0, 0, 0, 0]
+        self.latest = minute
+
+    def _prefix(self, slot):
+        # Totals of the slots up to and including slot
+        totals = [0, 0, 0, 0]
+        index = slot + 1
+        while index > 0:
+            for i, tree in enumerate(self._trees):
+                totals[i] += tree[index]
+            index -= index & -index
+        return totals
+
+    def totals(self, first, last):
+        '''
+        Totals of the minutes from first to last included, as (sum, count, boundary_sum, boundary_count).
+        Minutes outside of the ring count as empty.
+        '''
+        if self.latest is None:
+            return (0, 0, 0, 0)
+        first, last = max(first, self.oldest), min(last, self.latest)
+        if first > last:
+            return (0, 0, 0, 0)
+
+        first_slot, last_slot = first % self.size, last % self.size
+        if first_slot <= last_slot:
+            upper, lower = self._prefix(last_slot), self._prefix(first_slot - 1)
+        else:
+            # The range wraps around the end of the ring
+            upper = [a + b for a, b in zip(self._prefix(self.size - 1), self._prefix(last_slot))]
+            lower = self._prefix(first_slot - 1)
+        return tuple(a - b for a, b in zip(upper, lower))
+
+    def average(self, minute, window_size):
+        '''
+        The moving average of a minute, over the events in the window_size minutes before it, as in
+        stream_moving_average(). Requires oldest + window_size <= minute.
+        '''
+        window_sum, window_count, _, _ = self.totals(minute - window_size, minute - 1)
+        _, _, boundary_sum, boundary_count = self.totals(minute - window_size + 1, minute - 1)
+        count = window_count + boundary_count
+        return (window_sum + boundary_sum) / count if count else 0
+
+class AggregationServer:
+    '''
+    Long-running aggregation of translation events received over sockets, answering moving average queries.
+
+    Producers send events as newline-delimited JSON, in the input format, on any number of concurrent
+    connections, and receive no reply. Any other line is a command, answered with a single JSON line:
+
+    - AVG <window_size> [<YYYY-MM-DD HH:MM>]: The moving average of the minute, as in the output of
+      unbabel_cli.py, given the events received so far. Defaults to the minute after the latest event,
+      whose window includes it. The window must be inside the history.
+    - STATS: The counters of the server.
+
+    Events only need to be roughly sorted: an event is aggregated as long as its minute is still inside
+    the history. Duplicates are detected within the horizon of duplicate_filter.
+
+    Parameters:
+        history -> int: The number of minutes kept, which is the largest window size that can be queried (optional).
+        decoder -> TranslationDecoder: Decodes the events (optional). Defaults to json.loads, skipping invalid lines.
+        duplicate_filter -> DuplicateFilter: Detects repeated translations (optional). Defaults to a horizon of history minutes.
+    '''
+
+    def __init__(self, history=1440, decoder=None, duplicate_filter=None):
+        self.ring = MinuteRing(history)
+        self.decoder = decoder if decoder is not None else TranslationDecoder(on_invalid='skip')
+        self.duplicate_filter = duplicate_filter if duplicate_filter is not None else DuplicateFilter(history)
+        self.late = 0
+        self.connections = 0
+        self._log_duplicate = RateLimitedLog("Duplicate translation detected: %s", "%d more duplicate translations detected")
+        self._log_late = RateLimitedLog("Translation older than the history: %s", "%d more translations older than the history", logging.WARNING)
+
+    def ingest(self, line):
+        '''
+        Decode an event and add it to the aggregates, unless it is invalid, a duplicate or too late.
+        '''
+        decoded = self.decoder.decode(line)
+        if decoded is None:
+            return
+        translation, timestamp = decoded
+
+        # The duplicate filter needs minutes that never decrease
+        minute = timestamp // MICROSECONDS_PER_MINUTE
+        if self.ring.latest is not None:
+            minute = max(minute, self.ring.latest)
+        if self.duplicate_filter.is_duplicate(translation['translation_id'], minute):
+            self._log_duplicate(translation)
+            return
+
+        if not self.ring.add(timestamp, translation['duration']):
+            self.late += 1
+            self._log_late(translation)
+
+    def command(self, line):
+        '''
+        Run a command.
+
+        Returns:
+            dict: The reply, with an "error" key if the command failed.
+        '''
+        name, *arguments = line.decode(errors='replace').split(maxsplit=1)
+        name = name.upper()
+
+        if name == 'STATS':
+            return {
+                'connections': self.connections,
+                'translations': self.duplicate_filter.misses - self.late,
+                'duplicates': self.duplicate_filter.hits,
+                'invalid': self.decoder.invalid,
+                'late': self.late,
+                'latest': format_minute(self.ring.latest) if self.ring.latest is not None else None,
+            }
+
+        if name != 'AVG':
+            return {'error': f"Unknown command {name}"}
+        if self.ring.latest is None:
+            return {'error': "No translations received yet"}
+
+        window_size, *date = arguments[0].split(maxsplit=1) if arguments else ['']
+        try:
+            window_size = int(window_size)
+            if date:
+                minute = to_timestamp(datetime.strptime(date[0], "%Y-%m-%d %H:%M")) // MICROSECONDS_PER_MINUTE
+            else:
+                minute = self.ring.latest + 1
+        except ValueError:
+            return {'error': "Usage: AVG <window_size> [<YYYY-MM-DD HH:MM>]"}
+
+        if not 0 < window_size <= self.ring.size:
+            return {'error': f"Window size must be between 1 and {self.ring.size}"}
+        if minute < self.ring.oldest + window_size:
+            return {'error': f"Minute must be at or after {format_minute(self.ring.oldest + window_size)}"}
+        return {
+            "date": format_minute(minute),
+            "average_delivery_time": f'{self.ring.average(minute, window_size):g}'
+        }
+
+    async def handle_connection(self, reader, writer):
+        '''
+        Serve a connection until the peer closes it. Data is read in large chunks and split into lines,
+        and the replies to the commands of a chunk are sent together.
+        '''
+        self.connections += 1
+        pending = b''
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    # A last line without a newline is still complete
+                    lines = [pending]
+                else:
+                    lines = (pending + data).split(b'\n')
+                    pending = lines.pop()
+                    if len(pending) > MAX_LINE_LENGTH:
+                        logging.warning("Closing a connection sending a line longer than %d bytes", MAX_LINE_LENGTH)
+                        return
+
+                replies = []
+                for line in lines:
+                    if not line.startswith(b'{'):
+                        line = line.strip()
+                        if not line:
+                            continue
+                        if not line.startswith(b'{'):
+                            replies.append(f'{json.dumps(self.command(line))}\n'.encode())
+                            continue
+                    self.ingest(line)
+                if replies:
+                    writer.write(b''.join(replies))
+                    await writer.drain()
+
+                if not data:
+                    return
+
+        except ConnectionError:
+            pass
+
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self, host=None, port=None, unix_socket=None, ready=None):
+        '''
+        Listen on a TCP port or a UNIX socket and serve connections until cancelled.
+
+        Parameters:
+            host -> str: The interface to listen on with port (optional). Defaults to every interface.
+            port -> int: The TCP port to listen on (optional).
+            unix_socket -> str: The path of the UNIX socket to listen on, instead of a TCP port (optional).
+            ready -> callable: Called once the server is listening (optional).
+        '''
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_socket, backlog=BACKLOG)
+            address = unix_socket
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, backlog=BACKLOG)
+            address = f"{host or '*'}:{port}"
+
+        logging.info(f"Listening on {address}")
+        if ready is not None:
+            ready()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if unix_socket is not None and os.path.exists(unix_socket):
+                os.remove(unix_socket)
+
+def _connect(host='127.0.0.1', port=None, unix_socket=None, timeout=5.0):
+    if unix_socket is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        connection.connect(unix_socket)
+        return connection
+    return socket.create_connection((host, port), timeout)
+
+def send_events(lines, host='127.0.0.1', port=None, unix_socket=None):
+    '''
+    Send events to a server, on a connection of their own.
+
+    Parameters:
+        lines -> iterable: The events, as lines of bytes in the input format.
+        host -> str: The host of the server, with port (optional).
+        port -> int: The TCP port of the server (optional).
+        unix_socket -> str: The path of the UNIX socket of the server, instead of a TCP port (optional).
+    '''
+    with _connect(host, port, unix_socket) as connection:
+        for line in lines:
+            connection.sendall(line if line.endswith(b'\n') else line + b'\n')
+
+def query(command, host='127.0.0.1', port=None, unix_socket=None):
+    '''
+    Send a command to a server and wait for its reply.
+
+    Parameters:
+        command -> str: The command, e.g. "AVG 10".
+        host -> str: The host of the server, with port (optional).
+        port -> int: The TCP port of the server (optional).
+        unix_socket -> str: The path of the UNIX socket of the server, instead of a TCP port (optional).
+
+    Returns:
+        dict: The reply of the server.
+    '''
+    with _connect(host, port, unix_socket) as connection:
+        connection.sendall(f'{command}\n'.encode())
+        reply = b''
+        while not reply.endswith(b'\n'):
+            data = connection.recv(READ_SIZE)
+            if not data:
+                break
+            reply += data
+    return json.loads(reply)
+
+def parse_cli_arguments(argv=None):
+    '''
+    Parses command line arguments for the server.
+
+    Parameters:
+        argv -> list: The arguments to parse (optional). Defaults to the ones the program was called with.
+
+    Returns:
+        args -> The parsed command line arguments
+    '''
+    parser = argparse.ArgumentParser(description="Aggregate translation events received over a socket and answer moving average queries.")
+    parser.add_argument("--host", help="Interface to listen on, or host to query, with --port (optional). Defaults to every interface, or to 127.0.0.1 when querying.")
+    parser.add_argument("--port", type=int, help="TCP port to listen on or to query.")
+    parser.add_argument("--unix_socket", help="Path of the UNIX socket to listen on or to query, instead of a TCP port.")
+    parser.add_argument("--history", type=int, default=1440, help="Number of minutes kept, which is the largest window size that can be queried (optional). Defaults to a day.")
+    parser.add_argument("--decoder", choices=TranslationDecoder.MODES, default="json", help="Decode every line with json.loads, or only fall back to it for lines not in the usual layout (optional).")
+    parser.add_argument("--dedup_horizon", type=int, help="Minutes during which a translation id is remembered to detect duplicates (optional). Defaults to the history.")
+    parser.add_argument("--dedup_mode", choices=DuplicateFilter.MODES, default="exact", help="Remember translation ids exactly or in fixed-size Bloom filters (optional).")
+    parser.add_argument("--dedup_capacity", type=int, default=1_000_000, help="Number of ids each Bloom filter is sized for (optional).")
+    parser.add_argument("--dedup_error_rate", type=float, default=0.001, help="False positive rate of each Bloom filter at full capacity (optional).")
+    parser.add_argument("--query", help="Instead of serving, send this command to a running server and print its reply, e.g. 'AVG 10' (optional).")
+
+    args = parser.parse_args(argv)
+
+    if (args.port is None) == (args.unix_socket is None):
+        logging.error("Error: Exactly one of --port and --unix_socket must be given")
+        return
+    if args.history <= 0:
+        logging.error("Error: History must be a positive integer")
+        return
+    if args.dedup_horizon is not None and args.dedup_horizon <= 0:
+        logging.error("Error: Duplicate detection horizon must be a positive integer")
+        return
+    if args.dedup_capacity <= 0:
+        logging.error("Error: Duplicate detection capacity must be a positive integer")
+        return
+    if not 0 < args.dedup_error_rate < 1:
+        logging.error("Error: Duplicate detection error rate must be between 0 and 1")
+        return
+
+    return args
+
+def main(argv=None):
+    args = parse_cli_arguments(argv)
+    if not args:
+        return
+
+    if args.query:
+        try:
+            print(json.dumps(query(args.query, args.host or '127.0.0.1', args.port, args.unix_socket)))
+        except (OSError, ValueError) as e:
+            logging.error(f"Error: Could not query the server: {str(e)}")
+        return
+
+    duplicate_filter = DuplicateFilter(args.dedup_horizon or args.history, args.dedup_mode, args.dedup_capacity, args.dedup_error_rate)
+    server = AggregationServer(args.history, TranslationDecoder(args.decoder, 'skip'), duplicate_filter)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+    except OSError as e:
+        logging.error(f"Error: Could not listen: {str(e)}")
+    except KeyboardInterrupt:
+        logging.info("Server stopped")
+
+if __name__ == "__main__":
+    main()